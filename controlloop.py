@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixed-rate control loop
+-----------------------
+
+Part of Stormpack
+
+Runs a chain of stages (e.g. read the pose, solve it with stewart.py, encode
+the EV3 command, send it) at a fixed rate, and measures where the time goes.
+The ticks are scheduled against absolute deadlines from the start of the
+loop (start + tick * period), not by chained sleeps, so the timing does not
+drift however long the stages take. Each wait sleeps coarsely and then spins
+for the last bit, for the precision the sleep alone does not give.
+
+When a tick runs past the deadline of the next one, it is counted as an
+overrun, and the missed ticks are skipped (not run in a burst to catch up),
+so the loop stays in phase with its original schedule.
+
+The loop keeps histograms of:
+- jitter: how late each tick started against its deadline,
+- each stage: how long it took,
+- the whole tick: how long all the stages took together,
+which can be read live from any thread while the loop is running.
+
+Example, driving a Stewart platform on a single EV3 brick:
+loop = ControlLoop(200, [('pose', lambda tick: joystickpose()),
+                         ('stewart', lambda pose: stewart.stewart(*pose)),
+                         ('encode', lambda lengths: encode(lengths)),
+                         ('send', ev3.send)])
+loop.start()
+...
+print(loop.stats())
+loop.stop()
+"""
+
+import bisect
+import threading
+import time
+
+# Upper edges of the histogram buckets [us], the last one being open
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+           20000, 50000, 100000, 200000, 500000, 1000000]
+
+# Time before each deadline spent spinning instead of sleeping [s]
+SPIN = 0.001
+
+
+''' Histogram of durations with fixed buckets (upper edges in microseconds),
+plus the count, mean and maximum. Written by one thread (the loop) and read
+by any.
+'''
+class Histogram:
+
+    def __init__(self, buckets = BUCKETS):
+        self.buckets = list(buckets)
+        self.reset()
+
+
+    ''' Empty the histogram.
+    '''
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+
+    ''' Add a duration in seconds.
+    '''
+    def add(self, duration):
+        microseconds = duration * 1e6
+        self.counts[bisect.bisect_left(self.buckets, microseconds)] += 1
+        self.count += 1
+        self.total += microseconds
+        if microseconds > self.maximum: self.maximum = microseconds
+
+
+    ''' Approximate percentile (0-100) from the buckets, as the upper edge of
+    the bucket it falls into (but not above the maximum) [us].
+    '''
+    def percentile(self, share, counts = None):
+        counts = counts or list(self.counts)
+        total = sum(counts)
+        if not total: return 0
+        running = 0
+        for bucket, count in enumerate(counts):
+            running += count
+            if running >= total * share / 100:
+                if bucket < len(self.buckets):
+                    return min(self.buckets[bucket], self.maximum)
+                return self.maximum
+        return self.maximum
+
+
+    ''' Snapshot of the histogram as a dictionary: count, mean, max, p50, p90
+    and p99 in microseconds, and the bucket counts keyed by their upper edges.
+    '''
+    def snapshot(self):
+        counts = list(self.counts)
+        count = self.count
+        return {'count': count,
+                'mean': self.total / count if count else 0,
+                'max': self.maximum,
+                'p50': self.percentile(50, counts),
+                'p90': self.percentile(90, counts),
+                'p99': self.percentile(99, counts),
+                'buckets': dict(zip([str(edge) for edge in self.buckets] +
+                                    ['inf'], counts))}
+
+
+''' Loop running the given stages at the given rate [Hz]. The stages are a
+list of (name, function) pairs: the first function gets the tick number,
+and each of the following ones gets the result of the previous one.
+'''
+class ControlLoop:
+
+    def __init__(self, rate, stages, buckets = BUCKETS):
+        self.period = 1 / rate
+        self.stages = list(stages)
+        self.jitter = Histogram(buckets)
+        self.latency = dict([(name, Histogram(buckets))
+                             for name, function in self.stages])
+        self.tick = Histogram(buckets)
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.running = False
+        self._thread = None
+
+
+    ''' Run the loop in the current thread, for the given number of ticks or
+    seconds (of this run), or until stopped (from another thread, or by a
+    stage). An error raised by a stage stops the loop and is raised on.
+    '''
+    def run(self, ticks = None, duration = None):
+        clock = time.perf_counter
+        period = self.period
+        self.running = True
+
+        start = clock()
+        tick = 0
+        done = 0  # Ticks run in this run
+        try:
+            while self.running:
+                if ticks is not None and done >= ticks: break
+                if duration is not None and tick * period >= duration: break
+
+                # Wait for the deadline: sleep most of the way, then spin
+                deadline = start + tick * period
+                remaining = deadline - clock()
+                if remaining > SPIN: time.sleep(remaining - SPIN)
+                now = clock()
+                while now < deadline: now = clock()
+                self.jitter.add(now - deadline)
+
+                # Run the stages, timing each
+                value = tick
+                begin = now
+                for name, function in self.stages:
+                    value = function(value)
+                    end = clock()
+                    self.latency[name].add(end - begin)
+                    begin = end
+                self.tick.add(begin - now)
+                self.ticks += 1
+                done += 1
+
+                # Next deadline, skipping the ones already missed
+                tick += 1
+                late = int((begin - start) / period) + 1
+                if late > tick:
+                    self.overruns += 1
+                    self.skipped += late - tick
+                    tick = late
+        finally:
+            self.running = False
+
+
+    ''' Run the loop in a background thread (see run).
+    '''
+    def start(self, ticks = None, duration = None):
+        self.running = True
+        self._thread = threading.Thread(target = self.run,
+                                        args = (ticks, duration), daemon = True)
+        self._thread.start()
+
+
+    ''' Stop the loop after the current tick, and wait for it if running in
+    the background.
+    '''
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+    ''' Live statistics of the loop, as a dictionary.
+    '''
+    def stats(self):
+        return {'rate': 1 / self.period,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'jitter': self.jitter.snapshot(),
+                'tick': self.tick.snapshot(),
+                'stages': dict([(name, histogram.snapshot())
+                                for name, histogram in self.latency.items()])}
+
+
+    ''' Empty all the statistics.
+    '''
+    def reset(self):
+        for histogram in [self.jitter, self.tick] + list(self.latency.values()):
+            histogram.reset()
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+
+
+# Self-test
+# =========
+
+if __name__ == '__main__':
+    import math
+
+    import mindctrl
+    import stewart
+
+    print('Fixed-rate control loop, oton.ribic@bug.hr')
+
+    # Circular motion of the platform, encoded as EV3 commands (not sent)
+    def pose(tick):
+        angle = tick / 500 * 2 * math.pi
+        return (10 * math.cos(angle), 10 * math.sin(angle), 100, 0, 0, 0)
+
+    def encode(lengths):
+        return mindctrl.ev3rotatemessage(*[(val - 100) * 10
+                                           for val in lengths[:4]])
+
+    loop = ControlLoop(500, [('pose', pose),
+                             ('stewart', lambda pose: stewart.stewart(*pose)),
+                             ('encode', encode)])
+    loop.run(duration = 2)
+    stats = loop.stats()
+    print('Ticks:', stats['ticks'], 'Overruns:', stats['overruns'])
+    for name, histogram in [('jitter', stats['jitter'])] + \
+                           list(stats['stages'].items()):
+        print('%-8s p50 %8.1f us  p99 %8.1f us  max %8.1f us' %
+              (name, histogram['p50'], histogram['p99'], histogram['max']))
@@ -5,6 +5,8 @@ Part of Stormpack
 Requires PySerial (as the Bluetooth is used only as a transmitter for
 standard serial port profiles). You can simply install it using:
 pip install pyserial
+The asyncio version (AsyncEV3) on a serial port requires pyserial-asyncio:
+pip install pyserial-asyncio
 
 You can freely use MindControl whatever way you wish,
 and distribute it as much as you like, either standalone
@@ -28,8 +30,11 @@ v1.3 - Added music generation sequence function (melody)
 
 # Inits
 
+import asyncio
+import concurrent.futures
 import datetime
 import struct
+import threading
 import time
 
 # General settings
@@ -68,6 +73,11 @@ def pack5b(value):  # Five-byte constant (LC4)
     b5 = (value >> 24) & 255
     return bytes((b1, b2, b3, b4, b5))
 
+# Mark a message as a direct command without reply (the command type byte,
+# following the message counter)
+def noreply(message):
+    return message[:2] + bytes((message[2] | 128,)) + message[3:]
+
 # Logging stuff
 def addlog(logline):
     if logtoconsole: print(logline)
@@ -84,6 +94,205 @@ def delaymove():
         addlog('Delay: ' + str(betweendelay))
         time.sleep(betweendelay)
 
+# Build a message for the EV3 to rotate up to four motors simultaneously,
+# each by its own angle, with the speeds calculated for all of them to finish
+# at the same time, the supplied speed applying to the longest one. It waits
+# for all the motors to finish before replying. This is the message of the
+# EV3 rotate instruction with simult, exposed separately so that it can be
+# prepared (encoded) apart from sending it.
+def ev3rotatemessage(*motors, speed = 100):
+
+    # Normalize input matrix
+    motors = [val or 0 for val in motors]
+    motors = motors + [0] * (4 - len(motors))  # Normalize to 4 values
+
+    # Get maximum angle of any motor (for further calculations)
+    maxangle = max([abs(val) for val in motors])
+
+    moves = []  # Aggregator of moves
+    for move in enumerate(motors):
+        if not move[1]: continue  # Zero-move, nothing to do
+        # Build a triplet [Motor byte, angle, rel. calculated speed: minimum 1]
+        moves.append([bytes((2 ** move[0],)),
+                      move[1],
+                      round(abs(speed * move[1] / maxangle)) or 1])
+
+    # Build a multipart message
+
+    header = bytes((0, 0, 0, 0, 0))  # Message number, reply, global variables
+
+    # Body instructions
+    body = bytes(0)  # Aggregator of message bytes
+    for move in moves:
+        # Iterate over each move, consisting of:
+        # motor bytes, signed angle, absolute speed
+
+        # Check rotation speed and set polarities accordingly
+        if move[1] < 0:
+            # Reverse
+            polarity = bytes((167, 0)) + \
+            move[0] + \
+            bytes((63,))
+        else:
+            # Forward
+            polarity = bytes((167, 0)) + \
+            move[0] + \
+            bytes((1,))
+        body += polarity
+
+        # Instruction, brick, motors, speed, rampup, hold, rampdown, brake afterwards
+        movement = bytes((174, 0)) + \
+                   move[0] + \
+                   pack2b(move[2]) + \
+                   pack5b(0) + \
+                   pack5b(move[1]) + \
+                   pack5b(0) + \
+                   bytes((1,))
+        body += movement
+
+    # Wait for completion
+    wait = bytes((170, 0, 15))  # Wait for all motors
+
+    return header + body + wait
+
+# Build a message for the EV3 to rotate a single motor (index 0-3) by the
+# given angle at the given speed, waiting for it to finish before replying.
+# This is one step of the EV3 rotate instruction without simult.
+def ev3stepmessage(motor, angle, speed = 100):
+    motorhex = bytes((2 ** motor,))  # Hex code for this motor
+    header = bytes((0, 0, 0, 0, 0))  # Message number, reply, global variables
+
+    # Check rotation speed and set polarities accordingly
+    if angle < 0:
+        # Reverse
+        polarity = bytes((167, 0)) + \
+        motorhex + \
+        bytes((63,))
+    else:
+        # Forward
+        polarity = bytes((167, 0)) + \
+        motorhex + \
+        bytes((1,))
+
+    # Instruction, brick, motors, speed, rampup, hold, rampdown, brake afterwards
+    body = bytes((174, 0)) + \
+           motorhex + \
+           pack2b(speed) + \
+           pack5b(0) + \
+           pack5b(angle) + \
+           pack5b(0) + \
+           bytes((1,))
+
+    # Send to begin rotating (not strictly necessary, but proper)
+    start = bytes((166, 0)) + motorhex
+
+    # Wait for completion
+    wait = bytes((170, 0, 15))  # Wait for all motors
+
+    return header + polarity + body + start + wait
+
+# Build a message for the EV3 to start spinning up to four motors, each with
+# its own speed, with None where nothing is to be changed and zero to stop a
+# motor (the message of the EV3 spin instruction)
+def ev3spinmessage(*speeds):
+
+    # Normalize input matrix
+    speeds = list(speeds)
+    speeds = speeds + [None] * (4 - len(speeds))  # Normalize to 4 values
+
+    message = bytes((0, 0, 0, 0, 0))  # Message byte aggregator
+    # Iterate through all the motors
+    for motor in enumerate(speeds):
+        if motor[1] == None: continue  # Nothing to do
+
+        # Value was specified - something to do
+        if motor[1] == 0:
+            # Stop the motor
+            submessage = bytes((163, 0, 2 ** motor[0], 1))
+            message = message + submessage
+        else:
+            # Start rotating the motor
+            if motor[1] < 0:  # Polarity
+                submessage = bytes((167, 0, 2 ** motor[0], 63))  # Reverse
+            else:
+                submessage = bytes((167, 0, 2 ** motor[0], 1))  # Forward
+            submessage = submessage + bytes((165, 0, 2 ** motor[0])) + pack2b(abs(motor[1]))
+            submessage = submessage + bytes((166, 0, 2 ** motor[0]))
+            message = message + submessage
+
+    return message
+
+# Build a message for the EV3 to read the sensor at the given port (1-4) in
+# the given mode (0 being the sensor default), replying with a float
+def ev3sensormessage(portnum, mode = 0):
+    return bytes((0, 0, 0, 4, 0, 153, 29, 0, portnum - 1, 0, mode, 1, 96))
+
+# Build a message for the EV3 to play a tone, optionally waiting until it is
+# played before replying
+def ev3tonemessage(frequency = 440, volume = 50, duration = 200, wait = True):
+    message = bytes((0, 0, 0, 0, 0, 148, 1))
+    message = message + pack2b(volume)
+    message = message + pack3b(frequency)
+    message = message + pack3b(duration)
+    if wait: message = message + bytes((150,))  # Wait until played
+    return message
+
+# Parse the mode of the color/light sensor, either a number or its name
+def ev3lightmode(mode):
+    if type(mode) != str: return mode
+    mode = mode.upper()
+    if mode.startswith('REFLECT'): return 0
+    if mode.startswith('AMBIENT'): return 1
+    if mode.startswith('COLORS') or mode.startswith('COLOURS'): return 2
+    raise ValueError('Unknown color/light sensor mode: ' + mode)
+
+# Normalize the sensor specifications of a snapshot into (port, mode, light)
+# triplets: a plain port number reads the sensor in its default mode (as the
+# sensor instruction), and a (port, mode) pair the color/light sensor in the
+# given mode (as the sensor_light instruction)
+def ev3snapshotspecs(specs):
+    triplets = []
+    for spec in specs:
+        if isinstance(spec, (tuple, list)):
+            triplets.append((spec[0], ev3lightmode(spec[1]), True))
+        else:
+            triplets.append((spec, 0, False))
+    return triplets
+
+# Build a message for the EV3 to read multiple sensors at once, each into
+# its own four-byte global variable, replying with all the values together
+def ev3snapshotmessage(*specs):
+    specs = ev3snapshotspecs(specs)
+    size = 4 * len(specs)  # Global variables, a float for each sensor
+    message = bytes((0, 0, 0, size % 256, size // 256))
+    for index, (portnum, mode, light) in enumerate(specs):
+        offset = 4 * index
+        if offset < 32:
+            variable = bytes((96 + offset,))  # Short global variable index
+        else:
+            variable = bytes((225, offset))  # One-byte global variable index
+        message = message + bytes((153, 29, 0, portnum - 1, 0, mode, 1)) + \
+                  variable
+    return message
+
+# Parse the reply to a snapshot message into the list of sensor values, in
+# the order of the specifications (None if the reply is improper)
+def ev3snapshotvalues(specs, reply):
+    specs = ev3snapshotspecs(specs)
+    if not reply or reply[2] != 2: return None  # Improper reply, error
+    if len(reply) != 3 + 4 * len(specs): return None  # Improper size, error
+
+    values = []
+    for index, (portnum, mode, light) in enumerate(specs):
+        value = struct.unpack('f', reply[3 + 4 * index:7 + 4 * index])[0]
+        if light and mode == 2:
+            # Color mode - the color code along with color name (tuple)
+            value = round(value)
+            value = (value, ev3colorsensor[value])
+        values.append(value)
+    return values
+
+
 # Color catalog for the EV3 color-mode (mode 2) detection
 ev3colorsensor = {0: 'NONE', 1: 'BLACK', 2:'BLUE', 3:'GREEN', \
                   4:'YELLOW', 5:'RED', 6:'WHITE', 7:'BROWN'}
@@ -244,10 +453,12 @@ class EV3:
         # Set variables
         self.relposition = [0, 0, 0, 0]  # Positions for relative moves
         self.relscale = [1, 1, 1, 1]  # Relative move scale (default 1: direct)
+        self.pipeline = None  # Pipelined commands, if started
 
 
     # Close a connection (clean end)
     def disconnect(self):
+        if self.pipeline: self.stoppipeline()
         self.port.close()
         addlog('EV3 Port closed')
 
@@ -286,55 +497,8 @@ class EV3:
             # Run all motors simultaneously
             # -----------------------------
 
-            # Get maximum angle of any motor (for further calculations)
-            maxangle = max([abs(val) for val in motors])
-
-            moves = []  # Aggregator of moves
-            for move in enumerate(motors):
-                if not move[1]: continue  # Zero-move, nothing to do
-                # Build a triplet [Motor byte, angle, rel. calculated speed: minimum 1]
-                moves.append([bytes((2 ** move[0],)),
-                              move[1],
-                              round(abs(speed * move[1] / maxangle)) or 1])
-
-            # Build a multipart message
-
-            header = bytes((0, 0, 0, 0, 0))  # Message number, reply, global variables
-
-            # Body instructions
-            body = bytes(0)  # Aggregator of message bytes
-            for move in moves:
-                # Iterate over each move, consisting of:
-                # motor bytes, signed angle, absolute speed
-
-                # Check rotation speed and set polarities accordingly
-                if move[1] < 0:
-                    # Reverse
-                    polarity = bytes((167, 0)) + \
-                    move[0] + \
-                    bytes((63,))
-                else:
-                    # Forward
-                    polarity = bytes((167, 0)) + \
-                    move[0] + \
-                    bytes((1,))
-                body += polarity
-
-                # Instruction, brick, motors, speed, rampup, hold, rampdown, brake afterwards
-                movement = bytes((174, 0)) + \
-                           move[0] + \
-                           pack2b(move[2]) + \
-                           pack5b(0) + \
-                           pack5b(move[1]) + \
-                           pack5b(0) + \
-                           bytes((1,))
-                body += movement
-
-            # Wait for completion
-            wait = bytes((170, 0, 15))  # Wait for all motors
-
             # Assemble and send a final message
-            message = header + body + wait
+            message = ev3rotatemessage(*motors, speed = speed)
             self.send(message)
 
             # Replied - movement finished. Delay if required
@@ -348,38 +512,8 @@ class EV3:
             for motor in enumerate(motors):
                 if not motor[1]: continue  # Zero angle - nothing to turn
 
-                motorhex = bytes((2 ** motor[0],))  # Hex code for this motor
-                header = bytes((0, 0, 0, 0, 0))  # Message number, reply, global variables
-
-                # Check rotation speed and set polarities accordingly
-                if motor[1] < 0:
-                    # Reverse
-                    polarity = bytes((167, 0)) + \
-                    motorhex + \
-                    bytes((63,))
-                else:
-                    # Forward
-                    polarity = bytes((167, 0)) + \
-                    motorhex + \
-                    bytes((1,))
-
-                # Instruction, brick, motors, speed, rampup, hold, rampdown, brake afterwards
-                body = bytes((174, 0)) + \
-                       motorhex + \
-                       pack2b(speed) + \
-                       pack5b(0) + \
-                       pack5b(motor[1]) + \
-                       pack5b(0) + \
-                       bytes((1,))
-
-                # Send to begin rotating (not strictly necessary, but proper)
-                start = bytes((166, 0)) + motorhex
-
-                # Wait for completion
-                wait = bytes((170, 0, 15))  # Wait for all motors
-
                 # Assemble and send a final message
-                message = header + polarity + body + start + wait
+                message = ev3stepmessage(motor[0], motor[1], speed = speed)
                 self.send(message)
 
                 # Replied - movement finished. Delay if required
@@ -427,7 +561,8 @@ class EV3:
     # optional, with None supplied where nothing is to be changed. Zero can
     # be supplied to stop a motor or more of them, though that employs a
     # different instruction than the one for spinning (a special case).
-    def spin(self, *speeds):
+    # With reply set to False, it is sent without waiting for the EV3 reply.
+    def spin(self, *speeds, reply = True):
         addlog('EV3 Spin:' + ','.join([str(val) for val in speeds]))
 
         # Parse motor data
@@ -436,43 +571,29 @@ class EV3:
             addlog('EV3 ERROR: Maximum 4 position parameters for spin instruction')
             return None
 
-        # Normalize input matrix
-        speeds = list(speeds)
-        speeds = speeds + [None] * (4 - len(speeds))  # Normalize to 4 values
-
-        message = bytes((0, 0, 0, 0, 0))  # Message byte aggregator
-        # Iterate through all the motors
-        for motor in enumerate(speeds):
-            if motor[1] == None: continue  # Nothing to do
-
-            # Value was specified - something to do
-            if motor[1] == 0:
-                # Stop the motor
-                submessage = bytes((163, 0, 2 ** motor[0], 1))
-                message = message + submessage
-            else:
-                # Start rotating the motor
-                if motor[1] < 0:  # Polarity
-                    submessage = bytes((167, 0, 2 ** motor[0], 63))  # Reverse
-                else:
-                    submessage = bytes((167, 0, 2 ** motor[0], 1))  # Forward
-                submessage = submessage + bytes((165, 0, 2 ** motor[0])) + pack2b(abs(motor[1]))
-                submessage = submessage + bytes((166, 0, 2 ** motor[0]))
-                message = message + submessage
-
         # Send aggregated message
-        self.send(message)
+        message = ev3spinmessage(*speeds)
+        self.send(message, reply)
 
 
     # Stop all motors, probably started by spin
-    def stop(self):
+    def stop(self, reply = True):
         addlog('EV3 Stop')
-        self.spin(0, 0, 0, 0)
+        self.spin(0, 0, 0, 0, reply = reply)
 
 
     # Send message to the EV3. Mostly to be used internally, though manual bytes
-    # can be supplied as well
-    def send(self, message):
+    # can be supplied as well. With reply set to False, the message is sent as
+    # a direct command without reply, and control is passed back right away
+    # (returning None), not waiting a round trip for the reply.
+    def send(self, message, reply = True):
+        # Pipelined if started, just waiting for its own reply
+        if self.pipeline:
+            future = self.submit(message, reply)
+            return self.waitreply(future) if reply else None
+
+        if not reply: message = noreply(message)
+
         # Calculate length (which does not count itself)
         msglen = bytes((len(message) % 256, len(message) // 256))  # LSB first
         fullmessage = msglen + message
@@ -481,6 +602,7 @@ class EV3:
         if self.port.isOpen():
             addlog('EV3 Send:' + ','.join([str(e) for e in list(fullmessage)]))
             self.port.write(fullmessage)  # Send message
+            if not reply: return None  # Nothing to wait for
 
             # Get reply
             replen = self.port.read(2)  # Two bytes, LSBf size
@@ -493,6 +615,147 @@ class EV3:
             return None  # Error a priori
 
 
+    # Start pipelining the commands: instead of only one command being sent
+    # and waited for at a time, up to 'depth' of them can be on their way to
+    # the EV3 at once. Each command gets its own message counter, and the
+    # replies are read in the background and handed over to their commands
+    # by the counters. Once started, all the instructions (from any number
+    # of threads) go through the pipeline, and submit can be used to send
+    # a command without waiting for its reply.
+    def startpipeline(self, depth = 4):
+        addlog('EV3 Pipeline started, depth ' + str(depth))
+        self.pipeline = {'counter': 0,
+                         'waiting': {},  # Futures by message counters
+                         'slots': threading.BoundedSemaphore(depth),
+                         'lock': threading.Lock(),
+                         'running': True,
+                         'timeout': self.port.timeout}
+
+        # Short timeout for the reader, to be able to stop any time
+        self.port.timeout = 0.05
+        self.pipeline['reader'] = threading.Thread(target = self._readreplies,
+                                                   daemon = True)
+        self.pipeline['reader'].start()
+
+
+    # Stop pipelining the commands (waits for all the outstanding replies),
+    # returning to one command at a time
+    def stoppipeline(self):
+        pipeline = self.pipeline
+        if not pipeline: return
+        futures = [future for future, original
+                   in list(pipeline['waiting'].values())]
+        late = concurrent.futures.wait(futures, pipeline['timeout'])[1]
+        for future in late: self._expire(pipeline, future)
+        pipeline['running'] = False
+        pipeline['reader'].join()
+        self.port.timeout = pipeline['timeout']
+        self.pipeline = None
+        addlog('EV3 Pipeline stopped')
+
+
+    # Send a message through the pipeline, returning a Future of its reply
+    # (concurrent.futures), to be waited for by waitreply. Blocks only while
+    # the pipeline is full. With reply set to False, it is sent without reply,
+    # taking no place in the pipeline, and None is returned instead.
+    def submit(self, message, reply = True):
+        pipeline = self.pipeline
+        future = None
+        if reply:
+            pipeline['slots'].acquire()
+            future = concurrent.futures.Future()
+        else:
+            message = noreply(message)
+
+        with pipeline['lock']:
+            # Number the message (counters 1-65535)
+            pipeline['counter'] = pipeline['counter'] % 65535 + 1
+            counter = pipeline['counter']
+            if reply: pipeline['waiting'][counter] = (future, message[0:2])
+            message = bytes((counter % 256, counter // 256)) + message[2:]
+
+            fullmessage = bytes((len(message) % 256, len(message) // 256)) + \
+                          message
+            addlog('EV3 Send:' + ','.join([str(e) for e in list(fullmessage)]))
+            self.port.write(fullmessage)  # Send message
+
+        return future
+
+
+    # Wait for the reply to a pipelined command (a Future from submit), for no
+    # longer than the port timeout. If it does not come, the command is given
+    # up, freeing its place in the pipeline, and TimeoutError is raised.
+    def waitreply(self, future):
+        pipeline = self.pipeline
+        try:
+            return future.result(pipeline['timeout'])
+        except concurrent.futures.TimeoutError:
+            self._expire(pipeline, future)
+            return future.result()  # Unless replied in the meantime
+
+
+    # Give up a pipelined command still waiting for its reply, failing its
+    # Future with TimeoutError
+    def _expire(self, pipeline, future):
+        for counter, (other, original) in list(pipeline['waiting'].items()):
+            if other is not future: continue
+            if pipeline['waiting'].pop(counter, None) is None: return  # Replied
+            pipeline['slots'].release()
+            addlog('EV3 ERROR: No reply to message ' + str(counter))
+            future.set_exception(concurrent.futures.TimeoutError(
+                'EV3 reply timed out'))
+            return
+
+
+    # Background reader of the pipelined replies, handing each over to the
+    # command with its message counter
+    def _readreplies(self):
+        pipeline = self.pipeline
+
+        # Read exactly the given number of bytes. Returns None when finished
+        # (stopped with nothing more to wait for, or stopped in the middle of
+        # a reply), or empty bytes when a reply was cut short, i.e. the rest
+        # of it did not come within the timeout
+        def readexact(size):
+            data = bytes(0)
+            last = time.monotonic()  # When the last bytes came
+            while len(data) < size:
+                chunk = self.port.read(size - len(data))
+                if chunk:
+                    data += chunk
+                    last = time.monotonic()
+                elif not data:
+                    if not (pipeline['running'] or pipeline['waiting']):
+                        return None  # Nothing more to wait for
+                elif not pipeline['running']:
+                    return None  # Stopped, the rest will not be waited for
+                elif pipeline['timeout'] is not None and \
+                     time.monotonic() - last > pipeline['timeout']:
+                    addlog('EV3 ERROR: Reply cut short (discarded)')
+                    return bytes(0)
+            return data
+
+        while True:
+            replen = readexact(2)  # Two bytes, LSBf size
+            if replen is None: break  # Finished
+            if not replen: continue  # Cut short
+            replen = replen[0] + replen[1] * 256  # Get numerical value
+            reply = readexact(replen)  # Read message payload
+            if reply is None: break  # Finished
+            if len(reply) < 2: continue  # Cut short
+            addlog('EV3 Receive:' + ','.join([str(e) for e in list(reply)]))
+
+            waiting = pipeline['waiting'].pop(reply[0] + reply[1] * 256, None)
+            if waiting is None:
+                addlog('EV3 ERROR: Reply to an unknown message')
+                continue
+            pipeline['slots'].release()
+
+            # Hand over with the counter the message was submitted with
+            future, original = waiting
+            future.set_result(original + reply[2:])
+
+
     # Universal sensor instruction, i.e. independent from sensor type or mode.
     # Get the sensor numerical value from the given port (ranging from 1 to 4),
     # therefore used as sensor(1). Running in sensor-default mode, i.e. without
@@ -501,7 +764,7 @@ class EV3:
         addlog('EV3 Sensor ' + str(portnum))
 
         # Construct a message
-        message = bytes((0, 0, 0, 4, 0, 153, 29, 0, portnum - 1, 0, 0, 1, 96))
+        message = ev3sensormessage(portnum)
         reply = self.send(message)
 
         # Parse out a reply
@@ -523,14 +786,10 @@ class EV3:
         addlog('EV3 Color/Light Port:' + str(portnum) + ' Mode:' + str(mode))
 
         # Check mode (if a string instead of a number)
-        if type(mode) == str:
-            mode = mode.upper()
-            if mode.startswith('REFLECT'): mode = 0
-            if mode.startswith('AMBIENT'): mode = 1
-            if mode.startswith('COLORS') or mode.startswith('COLOURS'): mode = 2
+        mode = ev3lightmode(mode)
 
         # Construct and send a message
-        message = bytes((0, 0, 0, 4, 0, 153, 29, 0, portnum - 1, 0, mode, 1, 96))
+        message = ev3sensormessage(portnum, mode)
         reply = self.send(message)
         reply = struct.unpack('f', reply[-4:])[0]  # Parse the value out
 
@@ -543,22 +802,29 @@ class EV3:
         return reply
 
 
+    # Read multiple sensors in one go (a single command and reply), returning
+    # the list of their values. Supply each sensor either as a port number,
+    # read as by the sensor instruction, or as a (port, mode) pair, read as
+    # by the sensor_light instruction. Usage example:
+    # touch, (color, name), reflect = snapshot(1, (2, 'colors'), (3, 0))
+    def snapshot(self, *specs):
+        addlog('EV3 Snapshot:' + ','.join([str(val) for val in specs]))
+        reply = self.send(ev3snapshotmessage(*specs))
+        return ev3snapshotvalues(specs, reply)
+
+
     # Play a sound of a specified frequency, volume and duration.
     # Frequency is in Hz, volume in percentage (1-100) and duration in
     # milliseconds. Control is passed back only after the tone is
-    # fully played.
-    def tone(self, frequency = 440, volume = 50, duration = 200):
+    # fully played, unless reply is set to False, in which case the tone is
+    # just started, without waiting for anything.
+    def tone(self, frequency = 440, volume = 50, duration = 200, reply = True):
         addlog('EV3 Sound Frequency:' + str(frequency) + 'Hz Volume:' + \
                str(volume) + '% Duration:' + str(duration) + 'ms')
 
         # Construct a message
-        message = bytes((0, 0, 0, 0, 0, 148, 1))
-        message = message + pack2b(volume)
-        message = message + pack3b(frequency)
-        message = message + pack3b(duration)
-        message = message + bytes((150,))  # Wait until played
-
-        self.send(message)
+        message = ev3tonemessage(frequency, volume, duration, wait = reply)
+        self.send(message, reply)
 
 
     # Selftest the EV3 (rotate all motors)
@@ -571,6 +837,395 @@ class EV3:
         addlog('EV3 Self-test complete')
 
 
+# Sensor streaming
+# ================
+
+# Polls the sensors of an EV3 in the background at a fixed rate, reading all
+# of them in a single command per tick (see EV3.snapshot), and keeps the
+# timestamped samples in a fixed-size ring buffer. The latest sample can
+# be read any time without waiting for the EV3, and callbacks can be
+# subscribed to get each sample as it arrives (called from the background
+# thread, so they should be quick). Sensors are specified as for snapshot.
+# Usage example:
+# stream = SensorStream(ev3, [1, (2, 'reflect'), (3, 'colors')], rate = 50)
+# stream.start()
+# timestamp, (touch, reflect, color) = stream.latest()
+# stream.stop()
+class SensorStream:
+
+    # Prepare the stream of the given sensors, polled at the given rate (Hz),
+    # keeping the given number of the last samples. The sensors are checked
+    # here, raising ValueError on an invalid port or mode.
+    def __init__(self, ev3, specs, rate = 20, size = 1000):
+        self.ev3 = ev3
+        self.specs = list(specs)
+        if not self.specs: raise ValueError('No sensors to stream')
+        for portnum, mode, light in ev3snapshotspecs(self.specs):
+            if portnum not in (1, 2, 3, 4):
+                raise ValueError('Sensor port must be 1-4: ' + str(portnum))
+        self.period = 1 / rate
+        self.size = size
+        self.samples = [None] * size  # Ring buffer of (timestamp, values)
+        self.index = 0  # Position of the next sample in the ring buffer
+        self.count = 0  # Number of all the samples taken
+        self.errors = 0  # Number of the failed reads
+        self.failure = None  # Error that stopped the stream, if any
+        self.overruns = 0  # Number of the ticks taking longer than the period
+        self.last = None  # Latest sample
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+
+    # Start polling in the background
+    def start(self):
+        addlog('EV3 Sensor stream started:' +
+               ','.join([str(val) for val in self.specs]))
+        self.running = True
+        self.thread = threading.Thread(target = self._poll, daemon = True)
+        self.thread.start()
+
+
+    # Stop polling, after the current tick
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        addlog('EV3 Sensor stream stopped')
+
+
+    # Latest sample as a (timestamp, values) pair, or None if none yet. The
+    # timestamp is time.time() of the moment the values arrived.
+    def latest(self):
+        return self.last
+
+
+    # The last samples (all kept, or the given count of them), oldest first
+    def history(self, count = None):
+        with self.lock:
+            kept = min(self.count, self.size)
+            if count is None or count > kept: count = kept
+            start = (self.index - count) % self.size
+            if start + count <= self.size:
+                return self.samples[start:start + count]
+            return self.samples[start:] + \
+                   self.samples[:start + count - self.size]
+
+
+    # Subscribe a callback, called with the timestamp and values of each
+    # sample as it arrives
+    def subscribe(self, callback):
+        self.callbacks = self.callbacks + [callback]
+
+
+    # Unsubscribe a callback
+    def unsubscribe(self, callback):
+        self.callbacks = [other for other in self.callbacks
+                          if other is not callback]
+
+
+    # Background polling: ticks against absolute deadlines, so the rate does
+    # not drift, skipping the ticks already missed
+    def _poll(self):
+        start = time.perf_counter()
+        tick = 0
+        while self.running:
+            remaining = start + tick * self.period - time.perf_counter()
+            if remaining > 0: time.sleep(remaining)
+
+            # A failed read (serial error, or a reply cut short by the timeout)
+            # is counted and skipped, anything else stops the stream
+            try:
+                values = self.ev3.snapshot(*self.specs)
+            except (OSError, IndexError) as error:
+                addlog('EV3 ERROR: Sensor stream read failed: ' + str(error))
+                values = None
+            except Exception as error:
+                addlog('EV3 ERROR: Sensor stream stopped: ' + repr(error))
+                self.failure = error
+                self.running = False
+                break
+
+            if values is None:
+                self.errors += 1
+            else:
+                sample = (time.time(), values)
+                with self.lock:
+                    self.samples[self.index] = sample
+                    self.index = (self.index + 1) % self.size
+                    self.count += 1
+                self.last = sample
+
+                for callback in self.callbacks:
+                    try:
+                        callback(*sample)
+                    except Exception as error:
+                        addlog('EV3 ERROR: Sensor stream callback failed: ' +
+                               str(error))
+
+            # Next deadline, skipping the ones already missed
+            tick += 1
+            late = int((time.perf_counter() - start) / self.period) + 1
+            if late > tick:
+                self.overruns += 1
+                tick = late
+
+
+# Asyncio EV3 class
+# =================
+
+# The EV3 for asyncio: the same instructions, but awaitable, so that one event
+# loop can drive any number of bricks at once. The commands do not block the
+# loop while waiting for their replies (e.g. during the motor moves): the
+# replies are read in the background and handed over to their commands by
+# the message counters, so more commands can be on their way at once.
+# Usage example:
+# ev3 = await AsyncEV3('COM8').connect()
+# await ev3.rotate(90, 180, simult = True)
+# value = await ev3.sensor(1)
+# await ev3.disconnect()
+class AsyncEV3:
+
+    # Prepare a connection (opened by connect). Supply either the serial port
+    # (as for EV3), or a (host, port) tuple to connect over TCP, e.g. to
+    # a serial-to-network bridge. Timeout applies to each reply (in seconds,
+    # None for no timeout).
+    def __init__(self, conn = 'COM8', baudrate = 28800, timeout = 15):
+        self.conn = conn
+        self.baudrate = baudrate
+        self.timeout = timeout
+
+        # Set variables
+        self.relposition = [0, 0, 0, 0]  # Positions for relative moves
+        self.relscale = [1, 1, 1, 1]  # Relative move scale (default 1: direct)
+        self.counter = 0  # Last message counter used
+        self.waiting = {}  # Futures of the replies by message counters
+        self.reader = None
+        self.writer = None
+        self.task = None  # Background reader of the replies
+
+
+    # Establish the connection, returning self (to be used as above)
+    async def connect(self):
+        addlog('Opening EV3 port...')
+        if isinstance(self.conn, tuple):
+            self.reader, self.writer = await asyncio.open_connection(*self.conn)
+        else:
+            import serial_asyncio
+            self.reader, self.writer = \
+                await serial_asyncio.open_serial_connection(
+                    url = self.conn, baudrate = self.baudrate)
+        self.task = asyncio.get_running_loop().create_task(self._readreplies())
+        addlog('EV3 Port open')
+        return self
+
+
+    # Close a connection (clean end)
+    async def disconnect(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.writer.close()
+        await self.writer.wait_closed()
+        self._fail('EV3 Port closed')
+        addlog('EV3 Port closed')
+
+
+    # Fail all the commands still waiting for their replies
+    def _fail(self, reason):
+        for future in self.waiting.values():
+            if not future.done(): future.set_exception(ConnectionError(reason))
+        self.waiting = {}
+
+
+    # Background reader of the replies, handing each over to the command with
+    # its message counter
+    async def _readreplies(self):
+        while True:
+            try:
+                replen = await self.reader.readexactly(2)  # Two bytes, LSBf size
+                replen = replen[0] + replen[1] * 256  # Get numerical value
+                reply = await self.reader.readexactly(replen)  # Read payload
+            except (asyncio.IncompleteReadError, ConnectionError):
+                addlog('EV3 ERROR: Connection lost')
+                self._fail('EV3 connection lost')
+                return
+            addlog('EV3 Receive:' + ','.join([str(e) for e in list(reply)]))
+
+            future = self.waiting.pop(reply[0] + reply[1] * 256, None)
+            if future is None:
+                addlog('EV3 ERROR: Reply to an unknown message')
+                continue
+            if not future.done(): future.set_result(reply)
+
+
+    # Send message to the EV3, and wait for its reply (without blocking the
+    # loop). With reply set to False, the message is sent as a direct command
+    # without reply, returning None once written. Returns None on timeout.
+    async def send(self, message, reply = True):
+        if not reply: message = noreply(message)
+
+        # Number the message (counters 1-65535), keeping the original one
+        # for the reply
+        self.counter = self.counter % 65535 + 1
+        counter = self.counter
+        original = message[0:2]
+        message = bytes((counter % 256, counter // 256)) + message[2:]
+        if reply:
+            future = asyncio.get_running_loop().create_future()
+            self.waiting[counter] = future
+
+        # Send
+        fullmessage = bytes((len(message) % 256, len(message) // 256)) + message
+        addlog('EV3 Send:' + ','.join([str(e) for e in list(fullmessage)]))
+        self.writer.write(fullmessage)
+        await self.writer.drain()
+        if not reply: return None  # Nothing to wait for
+
+        # Get reply
+        try:
+            answer = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.waiting.pop(counter, None)
+            addlog('EV3 ERROR: No reply (timed out)')
+            return None
+        return (original + answer[2:]) or None
+
+
+    # Delay between movements
+    async def _delaymove(self):
+        if betweendelay > 0:
+            addlog('Delay: ' + str(betweendelay))
+            await asyncio.sleep(betweendelay)
+
+
+    # Rotate multiple motors, as EV3.rotate
+    async def rotate(self, *motors, speed = 100, simult = False):
+        addlog('EV3 Rotate Abs - Spd:' + str(speed) + ' Simult:' + str(simult) + \
+                ' Angs:' + ','.join([str(val) for val in motors]))
+
+        # Parse motor data
+        if len(motors) > 4:
+            # Wrong number of parameters
+            addlog('EV3 ERROR: Maximum 4 angle parameters for rotate instruction')
+            return None  # Error a priori
+
+        # Normalize input matrix
+        motors = [val or 0 for val in motors]
+        motors = motors + [0] * (4 - len(motors))  # Normalize to 4 values
+
+        if simult:
+            # Run all motors simultaneously
+            await self.send(ev3rotatemessage(*motors, speed = speed))
+            await self._delaymove()
+        else:
+            # Run each motor separately (sequentially)
+            for motor in enumerate(motors):
+                if not motor[1]: continue  # Zero angle - nothing to turn
+                await self.send(ev3stepmessage(motor[0], motor[1],
+                                               speed = speed))
+                await self._delaymove()
+
+
+    # Move four motors to specified relative positions, as EV3.rotateto
+    async def rotateto(self, *relpos, speed = 100, simult = False):
+        addlog('EV3 Rotate Rel - Spd:' + str(speed) + ' Simult:' + str(simult) + \
+               ' Pos:' + ','.join([str(val) for val in relpos]))
+
+        # Parse motor data
+        if len(relpos) > 4:
+            # Wrong number of parameters
+            addlog('EV3 ERROR: Maximum 4 position parameters for rotateto instruction')
+            return None  # Error a priori
+
+        # Normalize input matrix
+        relpos = list(relpos)
+        relpos = relpos + [None] * (4 - len(relpos))  # Normalize to 4 values
+
+        deltas = []  # Aggregator of 'differences' for the motors to make
+        for motor in enumerate(relpos):
+            if motor[1] == None:
+                deltas.append(0)  # Nothing to do
+                continue
+
+            # Value was specified
+            delta = motor[1] - self.relposition[motor[0]]  # Get difference
+            deltas.append(delta * self.relscale[motor[0]])  # Multiply by scale
+            self.relposition[motor[0]] = motor[1]  # Update relative position
+
+        # Perform the actual rotations
+        await self.rotate(*deltas, speed = speed, simult = simult)
+
+
+    # Start rotating the motors, as EV3.spin
+    async def spin(self, *speeds, reply = True):
+        addlog('EV3 Spin:' + ','.join([str(val) for val in speeds]))
+
+        # Parse motor data
+        if len(speeds) > 4:
+            # Wrong number of parameters
+            addlog('EV3 ERROR: Maximum 4 position parameters for spin instruction')
+            return None
+
+        await self.send(ev3spinmessage(*speeds), reply)
+
+
+    # Stop all motors, probably started by spin
+    async def stop(self, reply = True):
+        addlog('EV3 Stop')
+        await self.spin(0, 0, 0, 0, reply = reply)
+
+
+    # Universal sensor instruction, as EV3.sensor
+    async def sensor(self, portnum):
+        addlog('EV3 Sensor ' + str(portnum))
+        reply = await self.send(ev3sensormessage(portnum))
+
+        # Parse out a reply
+        if not reply or reply[0:3] != bytes((0, 0, 2)): return None  # Error
+        if len(reply) != 7: return None  # Improper size, error
+
+        # Unpack bytes
+        return struct.unpack('f', reply[3:7])[0]
+
+
+    # EV3 color/light sensor instruction, as EV3.sensor_light
+    async def sensor_light(self, portnum, mode):
+        addlog('EV3 Color/Light Port:' + str(portnum) + ' Mode:' + str(mode))
+        mode = ev3lightmode(mode)
+        reply = await self.send(ev3sensormessage(portnum, mode))
+        if not reply: return None  # Error
+        reply = struct.unpack('f', reply[-4:])[0]  # Parse the value out
+
+        # Analyse and return the answer according to the mode
+        if mode == 2:
+            # Color mode - return the color code along with color name (tuple)
+            reply = round(reply)
+            reply = (reply, ev3colorsensor[reply])
+
+        return reply
+
+
+    # Read multiple sensors in one go, as EV3.snapshot
+    async def snapshot(self, *specs):
+        addlog('EV3 Snapshot:' + ','.join([str(val) for val in specs]))
+        reply = await self.send(ev3snapshotmessage(*specs))
+        return ev3snapshotvalues(specs, reply)
+
+
+    # Play a sound, as EV3.tone
+    async def tone(self, frequency = 440, volume = 50, duration = 200,
+                   reply = True):
+        addlog('EV3 Sound Frequency:' + str(frequency) + 'Hz Volume:' + \
+               str(volume) + '% Duration:' + str(duration) + 'ms')
+        await self.send(ev3tonemessage(frequency, volume, duration,
+                                       wait = reply), reply)
+
+
 # Master NXT class
 # ================
 
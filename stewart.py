@@ -67,8 +67,25 @@ Azimuth 0 means that the each platform point is equally far from both its
 actuator's roots.
 
 The order of calculation is: offset; azimuth; alpha; beta; X-Y-Z offsets.
+
+The symmetric layout above is the default one, built from the constants
+below. The Geometry class accepts arbitrary root and target points as well
+(also loaded from a configuration file with loadgeometry), for asymmetric
+platforms, and all the calculations work the same for them.
+
+Run from the command line without arguments, it prints the actuator lengths
+of the neutral pose. Given a file of poses (CSV or NPY), it solves them all
+in chunks into lengths and feasibility, e.g.:
+python stewart.py poses.csv lengths.npy
+python stewart.py - < poses.csv > lengths.csv
+
+Batch functions (stewartbatch and onwards) require NumPy, which is not needed
+for the plain stewart function. You can simply install it using:
+pip install numpy
 """
 
+import collections
+import json
 import math
 
 # General constants for the platform to be set
@@ -96,103 +113,1078 @@ TGT_VERT_OFFSET = 16
 ACTUATOR_MIN=80
 ACTUATOR_MAX=140
 
+# Minimum clearance between any two actuators, e.g. their thickness [mm]
+ACTUATOR_CLEARANCE = 10
+
+# Maximum angles of the actuator joints, at the roots from the vertical, and
+# at the targets from the platform's vertical [degrees]
+JOINT_ROOT_MAXANGLE = 60
+JOINT_TGT_MAXANGLE = 60
+
 # Calculations
 # ============
 
+# Check and convert the given anchor points (roots or targets) into a tuple
+# of six (x, y, z) float tuples, raising ValueError if they are not that
+def _anchors(points, name):
+    try:
+        points = tuple([tuple([float(val) for val in point])
+                        for point in points])
+    except (TypeError, ValueError):
+        raise ValueError('Geometry ' + name + ' need to be six [x, y, z] '
+                         'points of numbers') from None
+    if len(points) != 6:
+        raise ValueError('Geometry ' + name + ' need to be six [x, y, z] '
+                         'points, got ' + str(len(points)))
+    if any([len(point) != 3 for point in points]):
+        raise ValueError('Geometry ' + name + ' need to be [x, y, z] points '
+                         '(three values each)')
+    return points
+
+
+''' Geometry of one particular platform. Holds the actuator roots and the
+untransformed actuator targets, calculated only once on creation, so that
+solving a pose costs just the rotation and the distances. Any dimension not
+supplied is taken from the module constants above (at the time of creation),
+which allows multiple platforms of different dimensions to coexist. The six
+roots and/or targets can also be given directly, as lists of six [x, y, z]
+points (the targets without the movement, i.e. at the pose 0,0,0,0,0,0),
+e.g. as measured or calibrated on a built platform.
+'''
+class Geometry:
+
+    def __init__(self, rootdistfc = None, rootadjdist = None,
+                 tgtdistfc = None, tgtadjdist = None, tgtvertoffset = None,
+                 actmin = None, actmax = None, roots = None, tgts = None):
+
+        # Fill in the defaults from the constants
+        if rootdistfc is None: rootdistfc = ACT_ROOT_DISTFC
+        if rootadjdist is None: rootadjdist = ACT_ROOT_ADJDIST
+        if tgtdistfc is None: tgtdistfc = ACT_TGT_DISTFC
+        if tgtadjdist is None: tgtadjdist = ACT_TGT_ADJDIST
+        if tgtvertoffset is None: tgtvertoffset = TGT_VERT_OFFSET
+        if actmin is None: actmin = ACTUATOR_MIN
+        if actmax is None: actmax = ACTUATOR_MAX
+        self.actmin = actmin
+        self.actmax = actmax
+
+        # Get the angle between the adjacent roots (based on right triangles)
+        adjrootang = math.atan(rootadjdist / rootdistfc / 2) * 360 / math.pi
+
+        # Place root points in space, unless given directly
+        if roots is None:
+            roots = []  # Master holder of 6x(x,y,z)
+            for act in range(6):
+                angle = (act // 2) * 120 + (act % 2) * adjrootang
+                angle *= math.pi / 180
+                roots.append((math.cos(angle) * rootdistfc,
+                              math.sin(angle) * rootdistfc, 0))
+        self.roots = _anchors(roots, 'roots')
+
+        # Determine angle between the adjacent targets (similar to the base)
+        adjtgtang = math.atan(tgtadjdist / tgtdistfc / 2) * 360 / math.pi
+        # Determine the angular offset between the base and the platform
+        angleoffset = adjrootang / 2 - adjtgtang / 2 - 60
+
+        # Place target points in space, with the vertical offset applied,
+        # unless given directly
+        if tgts is None:
+            tgts = []  # Master holder of 6x(x,y,z)
+            for act in range(1, 7):
+                angle = angleoffset + (act // 2) * 120 + (act % 2) * adjtgtang
+                angle *= math.pi / 180
+                tgts.append((math.cos(angle) * tgtdistfc,
+                             math.sin(angle) * tgtdistfc,
+                             - tgtvertoffset))
+        self.tgts = _anchors(tgts, 'targets')
+
+
+    ''' Save the geometry into a JSON configuration file, with the six roots
+    and targets as lists of [x, y, z] points and the actuator extents, which
+    can be loaded back with loadgeometry.
+    '''
+    def save(self, path):
+        config = {'roots': [list(point) for point in self.roots],
+                  'targets': [list(point) for point in self.tgts],
+                  'actmin': self.actmin,
+                  'actmax': self.actmax}
+        with open(path, 'w', encoding = 'utf8') as configfile:
+            json.dump(config, configfile)
+
+
+    ''' Solve a single pose, same as the master function: returns a list of
+    six actuator lengths, or None if the limiter is on and any of them is
+    out of the extents.
+    '''
+    def solve(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0,
+              limiter = False):
+
+        # One rotation matrix for all six points
+        return self.solverotation(xd, yd, zd, rotation(azimuth, alpha, beta),
+                                  limiter)
+
+
+    ''' Solve a single pose given by its X-Y-Z position and its orientation
+    directly, either as a rotation matrix (three rows of three) or as a unit
+    quaternion (w, x, y, z), skipping the angles altogether. Returns the
+    same as the solve function.
+    '''
+    def solverotation(self, xd, yd, zd, rot, limiter = False):
+        if len(rot) == 4: rot = quaternion(*rot)
+        (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = rot
+
+        distances = []
+        for (rx, ry, rz), (tx, ty, tz) in zip(self.roots, self.tgts):
+            # Rotated and moved target, relative to its root
+            dx = r00 * tx + r01 * ty + r02 * tz + xd - rx
+            dy = r10 * tx + r11 * ty + r12 * tz + yd - ry
+            dz = r20 * tx + r21 * ty + r22 * tz + zd - rz
+            distances.append(math.sqrt(dx * dx + dy * dy + dz * dz))
+
+        # Check actuator constraints if applicable
+        if limiter:
+            if min(distances) < self.actmin or max(distances) > self.actmax:
+                return None  # Failed
+
+        return distances
+
+
+    ''' Solve many poses at once given by their positions (N, 3) and their
+    orientations, either as rotation matrices (N, 3, 3) or unit quaternions
+    (N, 4) as w, x, y, z. Returns the same as solvebatch.
+    '''
+    def solverotationbatch(self, positions, rotations):
+        import numpy
+
+        rotations = numpy.asarray(rotations, dtype = float)
+        if rotations.shape[-1] == 4: rotations = quaternionbatch(rotations)
+        rotations = rotations.reshape(-1, 3, 3)
+        positions = numpy.broadcast_to(
+            numpy.asarray(positions, dtype = float).reshape(-1, 3),
+            (len(rotations), 3))
+
+        tgts = numpy.einsum('nij,aj->nai', rotations, numpy.array(self.tgts))
+        delta = tgts + positions[:, None, :] - numpy.array(self.roots)
+        distances = numpy.sqrt(numpy.einsum('nai,nai->na', delta, delta))
+        feasible = ((distances >= self.actmin) &
+                    (distances <= self.actmax)).all(axis = 1)
+
+        return distances, feasible
+
+
+    ''' Solve many poses at once with NumPy, same as stewartbatch: returns
+    an (N, 6) array of lengths and an N-sized feasibility mask.
+    '''
+    def solvebatch(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+                   beta = 0):
+        import numpy
+
+        # Measure distances between the moved targets and the roots
+        delta = self.targetsbatch(xd, yd, zd, azimuth, alpha, beta)[0] - \
+                numpy.array(self.roots)
+        distances = numpy.sqrt(numpy.einsum('nai,nai->na', delta, delta))
+
+        # Limiter mask
+        feasible = ((distances >= self.actmin) &
+                    (distances <= self.actmax)).all(axis = 1)
+
+        return distances, feasible
+
+
+    ''' Actuator targets moved into many poses at once (same arguments as
+    solvebatch). Returns an (N, 6, 3) array of the target points in space,
+    and the (N, 3, 3) rotation matrices of the poses.
+    '''
+    def targetsbatch(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+                     beta = 0):
+        import numpy
+
+        # Normalize input into N-sized float arrays
+        xd, yd, zd, azimuth, alpha, beta = numpy.broadcast_arrays(
+            *[numpy.atleast_1d(numpy.asarray(val, dtype = float))
+              for val in (xd, yd, zd, azimuth, alpha, beta)])
+
+        # Rotate all six targets of all poses at once (N, 6, 3), then offset
+        rot = rotationbatch(azimuth, alpha, beta)
+        tgts = numpy.einsum('nij,aj->nai', rot, numpy.array(self.tgts))
+        tgts += numpy.stack((xd, yd, zd), axis = -1)[:, None, :]
+
+        return tgts, rot
+
+
+    ''' Interference check of many poses at once (same arguments as
+    solvebatch), beyond the actuator extents: the legs (as lines between
+    their roots and targets) must be at least the clearance apart from each
+    other [mm], and their joints must not bend more than the given maximum
+    angles [degrees] from the base upwards at the roots, and from the
+    platform downwards at the targets. Missing limits come from the module
+    constants. Returns a tuple of:
+    - N-sized mask of the poses clear of interference,
+    - N-sized array of the smallest distances between any two legs,
+    - (N, 6) array of the joint angles at the roots,
+    - (N, 6) array of the joint angles at the targets.
+    '''
+    def interference(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+                     beta = 0, clearance = None, rootangle = None,
+                     tgtangle = None):
+        import numpy
+
+        if clearance is None: clearance = ACTUATOR_CLEARANCE
+        if rootangle is None: rootangle = JOINT_ROOT_MAXANGLE
+        if tgtangle is None: tgtangle = JOINT_TGT_MAXANGLE
+
+        tgts, rot = self.targetsbatch(xd, yd, zd, azimuth, alpha, beta)
+        roots = numpy.broadcast_to(numpy.array(self.roots), tgts.shape)
+        legs = tgts - roots
+        lengths = numpy.sqrt(numpy.einsum('nai,nai->na', legs, legs))
+        unit = legs / lengths[..., None]
+
+        # Joint angles: at the roots against the base normal (Z up), at the
+        # targets against the platform normal (rotated Z down)
+        rootangles = numpy.degrees(numpy.arccos(numpy.clip(unit[..., 2],
+                                                           -1, 1)))
+        normal = - rot[:, :, 2]  # Platform downwards, (N, 3)
+        tgtangles = numpy.degrees(numpy.arccos(numpy.clip(
+            numpy.einsum('nai,ni->na', - unit, normal), -1, 1)))
+
+        # Smallest distance between each pair of legs (segments)
+        first, second = numpy.triu_indices(6, 1)
+        distances = segmentdistance(roots[:, first], legs[:, first],
+                                    roots[:, second], legs[:, second])
+        mindistances = distances.min(axis = 1)
+
+        clear = (mindistances >= clearance) & \
+                (rootangles <= rootangle).all(axis = 1) & \
+                (tgtangles <= tgtangle).all(axis = 1)
+        return clear, mindistances, rootangles, tgtangles
+
+
+    ''' Limiter diagnostics for many poses at once (same arguments as
+    solvebatch). Returns the (N, 6) array of lengths, and two (N, 6) arrays
+    of their margins to the extents: the lower one (length - actmin) and the
+    upper one (actmax - length). A negative margin is the amount by which
+    that actuator is out of its extents; a pose is feasible if all its
+    margins are zero or positive.
+    '''
+    def margins(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+                beta = 0):
+        distances = self.solvebatch(xd, yd, zd, azimuth, alpha, beta)[0]
+        return distances, distances - self.actmin, self.actmax - distances
+
+
+    ''' Maximum reach from a pose (a list of xd, yd, zd, azimuth, alpha,
+    beta) along many directions in the pose space at once, given as an
+    (M, 6) array. For each direction, finds the farthest distance (in the
+    multiples of the direction vector) to which the platform moves from the
+    pose before any actuator gets out of its extents, up to maxdistance.
+    The directions are first scanned in the given number of steps, so that
+    the first boundary along each is found, and then bisected down to the
+    given tolerance. Returns an M-sized array of the distances, and the
+    (M, 6) array of the farthest poses. If the pose itself is out of the
+    extents, all the distances are zero.
+    '''
+    def reach(self, pose, directions, maxdistance = 100, steps = 20,
+              tolerance = 1e-6):
+        import numpy
+
+        pose = numpy.asarray(pose, dtype = float)
+        directions = numpy.atleast_2d(numpy.asarray(directions, dtype = float))
+        count = len(directions)
+        if not self.solvebatch(*pose)[1][0]:
+            return numpy.zeros(count), numpy.repeat(pose[None, :], count, 0)
+
+        def feasible(distances, directions):
+            poses = pose + distances[..., None] * directions
+            return self.solvebatch(*poses.reshape(-1, 6).T)[1] \
+                   .reshape(distances.shape)
+
+        # Coarse scan for the first step out of the extents
+        scan = numpy.linspace(0, maxdistance, steps + 1)[1:]
+        inside = feasible(numpy.repeat(scan[None, :], count, 0).T,
+                          directions).T
+        first = numpy.argmin(inside, axis = 1)  # First False, 0 if none
+        bounded = ~inside.all(axis = 1)
+        high = numpy.where(bounded, scan[first], maxdistance)
+        low = numpy.where(bounded, numpy.where(first > 0, scan[first - 1], 0),
+                          maxdistance)
+
+        # Bisect the boundary, all directions at once
+        while True:
+            active = high - low > tolerance
+            if not active.any(): break
+            middle = (low[active] + high[active]) / 2
+            ok = feasible(middle, directions[active])
+            index = numpy.flatnonzero(active)
+            low[index[ok]] = middle[ok]
+            high[index[~ok]] = middle[~ok]
+
+        return low, pose + low[:, None] * directions
+
+
+    ''' Limiter diagnostics for a single pose: returns a dictionary of the
+    actuators (0-5) out of their extents, with the amount by which each is
+    out, negative if too short and positive if too long. Empty if the pose
+    is feasible.
+    '''
+    def violations(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+                   beta = 0):
+        violations = {}
+        for act, dist in enumerate(self.solve(xd, yd, zd, azimuth, alpha,
+                                              beta)):
+            if dist < self.actmin: violations[act] = dist - self.actmin
+            if dist > self.actmax: violations[act] = dist - self.actmax
+        return violations
+
+
+    ''' Forward kinematics: estimate the pose (as a list of xd, yd, zd,
+    azimuth, alpha, beta) from six measured actuator lengths, by solving
+    the same equations as the solve function backwards (Levenberg-Marquardt).
+    Supply the previous pose as the guess when tracking the platform, which
+    makes it converge in just a couple of iterations. Returns None if it does
+    not converge to within the tolerance [mm] of the lengths.
+    '''
+    def forward(self, lengths, guess = None, tolerance = 1e-6, iterations = 30):
+        if guess is not None: guess = [guess]
+        poses, converged = self.forwardbatch([lengths], guess, tolerance,
+                                             iterations)
+        if not converged[0]: return None  # Failed
+        return poses[0].tolist()
+
+
+    ''' Forward kinematics for many sets of lengths at once, e.g. for the
+    post-processing of logged runs. Takes an (N, 6) array of lengths and
+    optionally an (N, 6) array of guessed poses, and returns the (N, 6)
+    array of poses along with an N-sized mask of converged ones.
+    '''
+    def forwardbatch(self, lengths, guess = None, tolerance = 1e-6,
+                     iterations = 30):
+        import numpy
+
+        lengths = numpy.atleast_2d(numpy.asarray(lengths, dtype = float))
+        if guess is None:
+            poses = self._home(lengths)
+        else:
+            poses = numpy.array(numpy.broadcast_to(
+                numpy.asarray(guess, dtype = float), lengths.shape))
+
+        # Damping per pose, kept low so that it is practically Newton-Raphson
+        # for as long as the steps are improving
+        damping = numpy.full(len(lengths), 1e-6)
+        eye = numpy.eye(6)
+
+        current, jacobian = self._kinematics(poses)
+        residual = lengths - current
+        error = numpy.einsum('na,na->n', residual, residual)
+
+        for iteration in range(iterations):
+            active = numpy.abs(residual).max(axis = 1) >= tolerance
+            if not active.any(): break  # All converged
+
+            # Levenberg-Marquardt step for the unconverged ones
+            jac = jacobian[active]
+            normal = numpy.einsum('nai,naj->nij', jac, jac)
+            normal += damping[active, None, None] * eye * \
+                      numpy.diagonal(normal, axis1 = 1, axis2 = 2)[:, None, :]
+            gradient = numpy.einsum('nai,na->ni', jac, residual[active])
+            step = numpy.linalg.solve(normal, gradient[..., None])[..., 0]
+
+            # Try it out and keep only the improvements
+            trial = poses[active] + step
+            tcurrent, tjacobian = self._kinematics(trial)
+            tresidual = lengths[active] - tcurrent
+            terror = numpy.einsum('na,na->n', tresidual, tresidual)
+            better = terror < error[active]
+
+            index = numpy.flatnonzero(active)
+            accepted = index[better]
+            poses[accepted] = trial[better]
+            jacobian[accepted] = tjacobian[better]
+            residual[accepted] = tresidual[better]
+            error[accepted] = terror[better]
+            damping[index] = numpy.where(better, damping[index] / 10,
+                                         damping[index] * 10)
+
+        converged = numpy.abs(residual).max(axis = 1) < tolerance
+        return poses, converged
+
+
+    ''' Generator of actuator setpoints for a straight move of the platform
+    from the start pose to the end pose (each given as a list of xd, yd, zd,
+    azimuth, alpha, beta). Yields lists of six lengths lazily, starting with
+    the start pose and ending with the end pose, with no actuator changing by
+    more than maxstep between successive setpoints. As the actuators do not
+    move linearly with the platform, the move is subdivided adaptively, also
+    wherever the lengths between two setpoints deviate from a straight line
+    by more than the tolerance (a quarter of maxstep if not given). With the
+    limiter on, yields None and stops at the first setpoint out of extents.
+    '''
+    def trajectory(self, start, end, maxstep, tolerance = None,
+                   limiter = False):
+        if tolerance is None: tolerance = maxstep / 4
+        start = [float(val) for val in start]
+        delta = [float(val) - val0 for val0, val in zip(start, end)]
+
+        # Solve the pose at the given fraction of the move
+        def setpoint(fraction):
+            return self.solve(*[val0 + fraction * dval
+                                for val0, dval in zip(start, delta)],
+                              limiter = limiter)
+
+        current = 0.0, setpoint(0.0)
+        yield current[1]
+        if current[1] is None: return  # Out of extents
+
+        # Pending fractions and setpoints, the next one on the top
+        pending = [(1.0, setpoint(1.0))]
+        while pending:
+            fraction, lengths = pending[-1]
+            middle = (current[0] + fraction) / 2
+            if fraction - current[0] > 1e-9:
+                # Check whether the interval needs subdividing, also when
+                # out of extents, to get as close to the extents as possible
+                midlengths = setpoint(middle)
+                if lengths is None or midlengths is None or \
+                   max([abs(val - val0) for val0, val
+                        in zip(current[1], lengths)]) > maxstep or \
+                   max([abs(valm - (val0 + val) / 2) for val0, valm, val
+                        in zip(current[1], midlengths, lengths)]) > tolerance:
+                    pending.append((middle, midlengths))
+                    continue
+
+            # Interval is fine (or the setpoint is out of extents)
+            pending.pop()
+            yield lengths
+            if lengths is None: return  # Out of extents
+            current = fraction, lengths
+
+
+    ''' Jacobian of the actuator lengths with respect to the pose, for many
+    poses at once (same arguments as solvebatch). Returns an (N, 6, 6) array
+    where each row is an actuator and each column a pose value (xd, yd, zd
+    in mm, then azimuth, alpha, beta per degree), an N-sized array of their
+    condition numbers, and an N-sized mask of the poses that are near a
+    singularity, i.e. with the condition number above the given limit. Close
+    to a singularity, small errors in the actuators move the platform a lot.
+    Note that the condition number depends on the units as well, being the
+    mix of mm and degrees here.
+    '''
+    def jacobian(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+                 beta = 0, maxcondition = 1000):
+        import numpy
+
+        poses = numpy.stack(numpy.broadcast_arrays(
+            *[numpy.atleast_1d(numpy.asarray(val, dtype = float))
+              for val in (xd, yd, zd, azimuth, alpha, beta)]), axis = -1)
+        jacobian = self._kinematics(poses)[1]
+        condition = numpy.linalg.cond(jacobian)
+        return jacobian, condition, ~(condition <= maxcondition)
+
+
+    ''' Calibrate the geometry of a built platform: from many samples of
+    commanded actuator lengths (N, 6) and the poses (N, 6) actually measured
+    at them, fit the root and target points of each actuator by the least
+    squares (Gauss-Newton, starting from this geometry). The measured poses
+    should vary in both positions and rotations for all the points to be
+    determined. Iterates until the points move by less than the tolerance
+    [mm]. Returns a tuple of the calibrated geometry (with the same limiter
+    extents), and the six root mean square residuals of the lengths.
+    '''
+    def calibrate(self, lengths, poses, iterations = 50, tolerance = 1e-6):
+        import numpy
+
+        lengths = numpy.atleast_2d(numpy.asarray(lengths, dtype = float))
+        poses = numpy.atleast_2d(numpy.asarray(poses, dtype = float))
+        rot = rotationbatch(*poses[:, 3:].T)  # (N, 3, 3)
+        position = poses[:, :3]
+
+        # Parameters of each actuator: root x,y,z and target x,y,z (6, 6)
+        params = numpy.concatenate((numpy.array(self.roots),
+                                    numpy.array(self.tgts)), axis = 1)
+        damping = 1e-9
+        eye = numpy.eye(6)
+
+        def residuals(params):
+            delta = numpy.einsum('nij,aj->nai', rot, params[:, 3:]) + \
+                    position[:, None, :] - params[:, :3]
+            distances = numpy.sqrt(numpy.einsum('nai,nai->na', delta, delta))
+            return lengths - distances, delta / distances[..., None]
+
+        residual, unit = residuals(params)
+        error = (residual ** 2).sum(axis = 0)
+        for iteration in range(iterations):
+            # Jacobian of the lengths per actuator (6, N, 6): by the root
+            # it is the negative unit vector, by the target the unit vector
+            # rotated back into the platform
+            jacobian = numpy.concatenate(
+                (- unit, numpy.einsum('nai,nij->naj', unit, rot)), axis = 2)
+            jacobian = jacobian.transpose(1, 0, 2)
+            normal = numpy.einsum('anp,anq->apq', jacobian, jacobian)
+            normal += damping * eye * \
+                      numpy.diagonal(normal, axis1 = 1, axis2 = 2)[:, None, :]
+            gradient = numpy.einsum('anp,na->ap', jacobian, residual)
+            step = numpy.linalg.solve(normal, gradient[..., None])[..., 0]
+            if numpy.abs(step).max() < tolerance: break  # Converged
+
+            # Keep only the improvements, per actuator
+            tresidual, tunit = residuals(params + step)
+            terror = (tresidual ** 2).sum(axis = 0)
+            better = terror < error
+            params[better] += step[better]
+            residual[:, better] = tresidual[:, better]
+            unit[:, better] = tunit[:, better]
+            error[better] = terror[better]
+            damping = damping / 10 if better.all() else damping * 10
+
+        geometry = Geometry(actmin = self.actmin, actmax = self.actmax,
+                            roots = params[:, :3], tgts = params[:, 3:])
+        return geometry, numpy.sqrt(error / len(lengths))
+
+
+    # Starting poses for the forward kinematics if no guess is given: level
+    # platform right above the center, at a height matching the lengths
+    def _home(self, lengths):
+        import numpy
+
+        roots = numpy.array(self.roots)
+        tgts = numpy.array(self.tgts)
+        horizontal = ((tgts[:, :2] - roots[:, :2]) ** 2).sum(axis = 1)
+        vertical = numpy.sqrt(numpy.maximum(lengths ** 2 - horizontal, 0))
+        poses = numpy.zeros(lengths.shape)
+        poses[:, 2] = (vertical + roots[:, 2] - tgts[:, 2]).mean(axis = 1)
+        return poses
+
+
+    # Lengths (N, 6) and their Jacobian (N, 6, 6) with respect to the pose,
+    # with the angles in degrees, for an (N, 6) array of poses
+    def _kinematics(self, poses):
+        import numpy
+
+        azimuth, alpha, beta = numpy.radians(poses[:, 3:].T)
+        sz, cz = numpy.sin(azimuth), numpy.cos(azimuth)
+        sa, ca = numpy.sin(alpha), numpy.cos(alpha)
+        sb, cb = numpy.sin(beta), numpy.cos(beta)
+
+        # Each of the three rotations, and their derivatives
+        rz, ra, rb, dz, da, db = numpy.zeros((6, len(poses), 3, 3))
+        rz[:, 0, 0] = rz[:, 1, 1] = cz
+        rz[:, 1, 0] = sz
+        rz[:, 0, 1] = - sz
+        rz[:, 2, 2] = 1
+        ra[:, 1, 1] = ra[:, 2, 2] = ca
+        ra[:, 2, 1] = sa
+        ra[:, 1, 2] = - sa
+        ra[:, 0, 0] = 1
+        rb[:, 0, 0] = rb[:, 2, 2] = cb
+        rb[:, 2, 0] = sb
+        rb[:, 0, 2] = - sb
+        rb[:, 1, 1] = 1
+        dz[:, 0, 0] = dz[:, 1, 1] = - sz
+        dz[:, 1, 0] = cz
+        dz[:, 0, 1] = - cz
+        da[:, 1, 1] = da[:, 2, 2] = - sa
+        da[:, 2, 1] = ca
+        da[:, 1, 2] = - ca
+        db[:, 0, 0] = db[:, 2, 2] = - sb
+        db[:, 2, 0] = cb
+        db[:, 0, 2] = - cb
+
+        tgts = numpy.array(self.tgts)
+        rot = rb @ ra @ rz
+        delta = numpy.einsum('nij,aj->nai', rot, tgts) + \
+                poses[:, None, :3] - numpy.array(self.roots)
+        distances = numpy.sqrt(numpy.einsum('nai,nai->na', delta, delta))
+        unit = delta / distances[..., None]
+
+        jacobian = numpy.empty(poses.shape[:1] + (6, 6))
+        jacobian[..., :3] = unit
+        for column, drot in enumerate((rb @ ra @ dz, rb @ da @ rz,
+                                       db @ ra @ rz), 3):
+            moved = numpy.einsum('nij,aj->nai', drot, tgts)
+            jacobian[..., column] = numpy.einsum('nai,nai->na', unit, moved) * \
+                                    (math.pi / 180)
+
+        return distances, jacobian
+
+
+''' Load a geometry from a JSON configuration file. The file holds an object
+with any of the Geometry arguments: either the dimensions of the symmetric
+layout (rootdistfc, rootadjdist, tgtdistfc, tgtadjdist, tgtvertoffset), or
+six arbitrary "roots" and "targets" points for asymmetric platforms, plus the
+actuator extents (actmin, actmax). Anything not given comes from the module
+constants. For example:
+{"roots": [[120, 0, 0], [118.8, 12, 0], ...],
+ "targets": [[51.7, -85.6, -16], [60.9, -79.3, -16], ...],
+ "actmin": 80, "actmax": 140}
+'''
+def loadgeometry(path):
+    with open(path, encoding = 'utf8') as configfile:
+        config = json.load(configfile)
+    if 'targets' in config: config['tgts'] = config.pop('targets')
+    return Geometry(**config)
+
+
+''' Memoization of solved poses, for when the same poses are asked for over
+and over again (e.g. stepping among a few recurring poses). The poses are
+quantized to the given resolution (a single one for all six values, or a
+list of six), and the lengths of the most recently used quantized poses (up
+to the given size) are kept, so a repeated pose costs only a dictionary
+lookup. Note that the lengths are calculated for the quantized pose, and
+returned as a tuple shared between the hits. Uses the module geometry (as at
+the time of creation) if no geometry is given. The hits and misses are
+counted, to tune the resolution and the size.
+'''
+class PoseCache:
+
+    def __init__(self, geometry = None, resolution = 0.01, size = 1024):
+        if geometry is None: geometry = getgeometry()
+        if isinstance(resolution, (int, float)): resolution = [resolution] * 6
+        self.geometry = geometry
+        self.resolution = list(resolution)
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._steps = [1 / step for step in self.resolution]
+        self._cache = collections.OrderedDict()
+
+
+    ''' Solve a pose through the cache, same as the master function, only
+    returning a tuple of the six lengths.
+    '''
+    def solve(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0,
+              limiter = False):
+        sx, sy, sz, saz, sa, sb = self._steps
+        key = (round(xd * sx), round(yd * sy), round(zd * sz),
+               round(azimuth * saz), round(alpha * sa), round(beta * sb))
+
+        cache = self._cache
+        distances = cache.get(key)
+        if distances is None:
+            # Miss, so solve the quantized pose and keep it
+            self.misses += 1
+            pose = [index * step for index, step in zip(key, self.resolution)]
+            distances = tuple(self.geometry.solve(*pose))
+            cache[key] = distances
+            if len(cache) > self.size: cache.popitem(last = False)
+        else:
+            self.hits += 1
+            cache.move_to_end(key)
+
+        # Check actuator constraints if applicable
+        if limiter:
+            if min(distances) < self.geometry.actmin or \
+               max(distances) > self.geometry.actmax:
+                return None  # Failed
+
+        return distances
+
+
+    ''' Empty the cache and reset the counters.
+    '''
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Geometry used by the module-level functions, rebuilt whenever any of the
+# module constants is changed
+_geometry = None
+_geometrykey = None
+
+''' Get the geometry as described by the module constants. It is cached, so
+this is cheap to call on every pose.
+'''
+def getgeometry():
+    global _geometry, _geometrykey
+
+    key = (ACT_ROOT_DISTFC, ACT_ROOT_ADJDIST, ACT_TGT_DISTFC, ACT_TGT_ADJDIST,
+           TGT_VERT_OFFSET, ACTUATOR_MIN, ACTUATOR_MAX)
+    if key != _geometrykey:
+        _geometry = Geometry()
+        _geometrykey = key
+    return _geometry
+
+
 ''' Master function taking into account the X-Y-Z positions, the azimuth
 (rotation in Z axis, and alpha/beta, i.e. rotations in X and Y axes
 respectively). Returns required actuator lengths for all six of them.
 '''
 def stewart(xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0,
             limiter = False):
+    return getgeometry().solve(xd, yd, zd, azimuth, alpha, beta, limiter)
+
+
+''' Master function for orientations given as a rotation matrix or a unit
+quaternion instead of the angles, see Geometry.solverotation.
+'''
+def stewartrotation(xd, yd, zd, rot, limiter = False):
+    return getgeometry().solverotation(xd, yd, zd, rot, limiter)
+
+
+''' Batch version of the master function, for whole motion profiles at once.
+Takes arrays (or scalars, broadcast against each other) of X-Y-Z positions,
+azimuths, alphas and betas, and evaluates them all in one pass with NumPy.
+Returns a tuple of an (N, 6) array of actuator lengths, and an N-sized boolean
+array which is True wherever all six lengths are within the limiter extents
+(ACTUATOR_MIN to ACTUATOR_MAX). Rows are calculated for every pose regardless
+of the limiter, so the mask is there only to be applied by the caller.
+'''
+def stewartbatch(xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0):
+    return getgeometry().solvebatch(xd, yd, zd, azimuth, alpha, beta)
+
+
+''' Limiter margins for many poses with the module geometry, see
+Geometry.margins.
+'''
+def margins(xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0):
+    return getgeometry().margins(xd, yd, zd, azimuth, alpha, beta)
+
+
+''' Maximum reach from a pose along many directions with the module geometry,
+see Geometry.reach.
+'''
+def reach(pose, directions, maxdistance = 100, steps = 20, tolerance = 1e-6):
+    return getgeometry().reach(pose, directions, maxdistance, steps,
+                               tolerance)
+
+
+''' Actuators out of extents for a single pose with the module geometry, see
+Geometry.violations.
+'''
+def violations(xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0):
+    return getgeometry().violations(xd, yd, zd, azimuth, alpha, beta)
+
+
+''' Forward kinematics with the module geometry: get the pose from six
+actuator lengths, see Geometry.forward.
+'''
+def forward(lengths, guess = None, tolerance = 1e-6, iterations = 30):
+    return getgeometry().forward(lengths, guess, tolerance, iterations)
+
+
+''' Forward kinematics of many sets of lengths with the module geometry, see
+Geometry.forwardbatch.
+'''
+def forwardbatch(lengths, guess = None, tolerance = 1e-6, iterations = 30):
+    return getgeometry().forwardbatch(lengths, guess, tolerance, iterations)
+
+
+''' Calibrate the module geometry from commanded lengths and measured poses,
+see Geometry.calibrate.
+'''
+def calibrate(lengths, poses, iterations = 50, tolerance = 1e-6):
+    return getgeometry().calibrate(lengths, poses, iterations, tolerance)
+
+
+''' Generator of actuator setpoints for a straight move with the module
+geometry, see Geometry.trajectory.
+'''
+def trajectory(start, end, maxstep, tolerance = None, limiter = False):
+    return getgeometry().trajectory(start, end, maxstep, tolerance, limiter)
+
+
+''' Jacobian and its conditioning for many poses with the module geometry,
+see Geometry.jacobian.
+'''
+def jacobian(xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0,
+             maxcondition = 1000):
+    return getgeometry().jacobian(xd, yd, zd, azimuth, alpha, beta,
+                                  maxcondition)
+
+
+''' Interference check of many poses with the module geometry, see
+Geometry.interference.
+'''
+def interference(xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0,
+                 clearance = None, rootangle = None, tgtangle = None):
+    return getgeometry().interference(xd, yd, zd, azimuth, alpha, beta,
+                                      clearance, rootangle, tgtangle)
+
+
+''' Smallest distances between pairs of line segments, given by their start
+points and their vectors to the end points, as arrays of 3D points (any
+shape ending with 3, broadcast against each other). Returns the array of
+the distances.
+'''
+def segmentdistance(start1, vector1, start2, vector2):
+    import numpy
 
-    # Convert input angles to radians
+    def dot(a, b): return (a * b).sum(axis = -1)
+
+    offset = start1 - start2
+    a = dot(vector1, vector1)
+    e = dot(vector2, vector2)
+    b = dot(vector1, vector2)
+    c = dot(vector1, offset)
+    f = dot(vector2, offset)
+    denominator = a * e - b * b
+
+    # Closest points on the infinite lines, clamped to the first segment
+    # (parallel segments take any point, here the start)
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        s = numpy.where(denominator > 1e-12 * a * e,
+                        (b * f - c * e) / denominator, 0)
+    s = numpy.clip(s, 0, 1)
+
+    # Matching point on the second segment, and back if clamped
+    t = (b * s + f) / e
+    s = numpy.where(t < 0, numpy.clip(- c / a, 0, 1),
+                    numpy.where(t > 1, numpy.clip((b - c) / a, 0, 1), s))
+    t = numpy.clip(t, 0, 1)
+
+    closest = offset + vector1 * s[..., None] - vector2 * t[..., None]
+    return numpy.sqrt(dot(closest, closest))
+
+
+''' Rotation matrix (as three rows of three) for an azimuth, alpha and beta
+in degrees, combined in the order of operation used by the master function,
+i.e. the matrix applied to a point rotates it by the azimuth first, then the
+alpha and then the beta.
+'''
+def rotation(azimuth, alpha, beta):
+
+    # Convert input angles to radians, and get their sines and cosines once
     azimuth = azimuth / 180 * math.pi
     alpha = alpha / 180 * math.pi
     beta = beta / 180 * math.pi
+    sz, cz = math.sin(azimuth), math.cos(azimuth)
+    sa, ca = math.sin(alpha), math.cos(alpha)
+    sb, cb = math.sin(beta), math.cos(beta)
+
+    # Product of the three (beta * alpha * azimuth), written out
+    return ((cb * cz - sb * sa * sz, - cb * sz - sb * sa * cz, - sb * ca),
+            (ca * sz, ca * cz, - sa),
+            (sb * cz + cb * sa * sz, - sb * sz + cb * sa * cz, cb * ca))
+
+
+''' Rotation matrix (as three rows of three) of a quaternion (w, x, y, z),
+normalized first, so it does not need to be of unit length exactly.
+'''
+def quaternion(w, x, y, z):
+    norm = 2 / (w * w + x * x + y * y + z * z)
+    return ((1 - norm * (y * y + z * z), norm * (x * y - w * z),
+             norm * (x * z + w * y)),
+            (norm * (x * y + w * z), 1 - norm * (x * x + z * z),
+             norm * (y * z - w * x)),
+            (norm * (x * z - w * y), norm * (y * z + w * x),
+             1 - norm * (x * x + y * y)))
+
 
-    # Firstly determine the position of the actuator roots in the space
-
-    # Get the angle between the adjacent roots (based on right triangles)
-    adjrootang = math.atan(ACT_ROOT_ADJDIST / ACT_ROOT_DISTFC / 2)
-    adjrootang *= 360 / math.pi
-
-    # Place root points in space
-    roots = []  # Master holder of 6x[x,y,z]
-    for act in range(6):
-        angle = ((act // 2) * 120 + (act % 2) * adjrootang) * math.pi / 180
-        roots.append([math.cos(angle) * ACT_ROOT_DISTFC,
-                      math.sin(angle) * ACT_ROOT_DISTFC, 0])
-
-    # Loaded to 'roots'. Now calculate the corner points of the platform
-
-    # Determine angle between the adjacent targets (similar to the base)
-    adjtgtang = math.atan(ACT_TGT_ADJDIST / ACT_TGT_DISTFC / 2) * 360 / math.pi
-    # Determine the angular offset between the base and the platform
-    angleoffset = adjrootang / 2 - adjtgtang / 2 - 60
-
-    # Place target points in space
-    tgts = []  # Master holder of 6x[x,y,z]
-    for act in range(1, 7):
-        angle = angleoffset + (act // 2) * 120 + (act % 2) * adjtgtang
-        angle *= math.pi / 180
-        tgts.append([math.cos(angle) * ACT_TGT_DISTFC,
-                     math.sin(angle) * ACT_TGT_DISTFC,
-                     - TGT_VERT_OFFSET])
-
-    # First transformation (vertical offset) done. Now perform rotations of the
-    # platform target points with the axis at X-Y 0,0
-
-    for order, point in enumerate(tgts):
-
-        # Rotate azimuth, around Z axis
-        cx = point[0] * math.cos(azimuth) - point[1] * math.sin(azimuth)
-        cy = point[0] * math.sin(azimuth) + point[1] * math.cos(azimuth)
-        point[0] = cx
-        point[1] = cy
-
-        # Rotate alpha, around X axis
-        cy = point[1] * math.cos(alpha) - point[2] * math.sin(alpha)
-        cz = point[1] * math.sin(alpha) + point[2] * math.cos(alpha)
-        point[1] = cy
-        point[2] = cz
-
-        # Rotate beta, around Y axis
-        cx = point[0] * math.cos(beta) - point[2] * math.sin(beta)
-        cz = point[0] * math.sin(beta) + point[2] * math.cos(beta)
-        point[0] = cx
-        point[2] = cz
-
-        # Linear X-Y-Z movements at the end
-        point[0] += xd
-        point[1] += yd
-        point[2] += zd
-
-        tgts[order] = point  # Change it in the master list
-
-    # Target points rotated. Now measure distances between them and their roots
-
-    distances = []
-    for act in range(6):  # Iterate over actuators
-
-        # Calculate distance between roots and targets
-        delta = [roots[act][d] - tgts[act][d] for d in [0, 1, 2]]
-        dist = sum([d ** 2 for d in delta]) ** 0.5
-        distances.append(dist)
-        
-    # Check actuator constraints if applicable
-    if limiter:
-        minimums = [dist < ACTUATOR_MIN for dist in distances]
-        maximums = [dist > ACTUATOR_MAX for dist in distances]
-        if any(minimums) or any(maximums): return None # Failed
-
-    # Gathered distances, return them
-    return distances
+''' Rotation matrices (N, 3, 3) of an (N, 4) array of quaternions, the same
+as the quaternion function but with NumPy.
+'''
+def quaternionbatch(quaternions):
+    import numpy
+
+    w, x, y, z = numpy.atleast_2d(numpy.asarray(quaternions, dtype = float)).T
+    norm = 2 / (w * w + x * x + y * y + z * z)
+    rot = numpy.empty(w.shape + (3, 3))
+    rot[:, 0, 0] = 1 - norm * (y * y + z * z)
+    rot[:, 0, 1] = norm * (x * y - w * z)
+    rot[:, 0, 2] = norm * (x * z + w * y)
+    rot[:, 1, 0] = norm * (x * y + w * z)
+    rot[:, 1, 1] = 1 - norm * (x * x + z * z)
+    rot[:, 1, 2] = norm * (y * z - w * x)
+    rot[:, 2, 0] = norm * (x * z - w * y)
+    rot[:, 2, 1] = norm * (y * z + w * x)
+    rot[:, 2, 2] = 1 - norm * (x * x + y * y)
+    return rot
+
+
+''' Rotation matrices (N, 3, 3) for arrays of azimuths, alphas and betas in
+degrees, the same as the rotation function but with NumPy.
+'''
+def rotationbatch(azimuth, alpha, beta):
+    import numpy
+
+    # Convert input angles to radians, and get their sines and cosines once
+    azimuth, alpha, beta = [numpy.radians(numpy.asarray(val, dtype = float))
+                            for val in (azimuth, alpha, beta)]
+    sz, cz = numpy.sin(azimuth), numpy.cos(azimuth)
+    sa, ca = numpy.sin(alpha), numpy.cos(alpha)
+    sb, cb = numpy.sin(beta), numpy.cos(beta)
+
+    # Product of the three (beta * alpha * azimuth), written out
+    rot = numpy.empty(azimuth.shape + (3, 3))
+    rot[..., 0, 0] = cb * cz - sb * sa * sz
+    rot[..., 0, 1] = - cb * sz - sb * sa * cz
+    rot[..., 0, 2] = - sb * ca
+    rot[..., 1, 0] = ca * sz
+    rot[..., 1, 1] = ca * cz
+    rot[..., 1, 2] = - sa
+    rot[..., 2, 0] = sb * cz + cb * sa * sz
+    rot[..., 2, 1] = - sb * sz + cb * sa * cz
+    rot[..., 2, 2] = cb * ca
+
+    return rot
     
 
+# Batch files
+# ===========
+
+''' Read poses from an open binary file (or stdin) in chunks. The format is
+either 'csv' (six values per line, separated by commas, with an optional
+header line), or 'npy' (an (N, 6) NumPy array file, read sequentially, so
+that even piped arrays can be read). Returns the number of the poses (known
+in advance only for NPY, None for CSV), and a generator of (M, 6) arrays of
+at most the given number of poses.
+'''
+def readposes(infile, informat = 'csv', chunk = 65536):
+    if informat == 'npy':
+        count, dtype = _npyheader(infile)
+        return count, _npychunks(infile, count, dtype, chunk)
+    return None, _csvchunks(infile, chunk)
+
+
+# Parse the header of an NPY poses file, returning the number of poses and
+# the data type
+def _npyheader(infile):
+    import numpy
+
+    version = numpy.lib.format.read_magic(infile)
+    if version == (1, 0):
+        shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(infile)
+    else:
+        shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(infile)
+    if len(shape) != 2 or shape[1] != 6 or (fortran and shape[0] > 1):
+        raise ValueError('Poses need to be a C-ordered (N, 6) array')
+    return shape[0], dtype
+
+
+# Read the data of an NPY poses file in chunks
+def _npychunks(infile, count, dtype, chunk):
+    import numpy
+
+    while count:
+        size = min(chunk, count)
+        data = infile.read(size * 6 * dtype.itemsize)
+        if len(data) < size * 6 * dtype.itemsize:
+            raise ValueError('Poses array ended prematurely')
+        yield numpy.frombuffer(data, dtype = dtype).reshape(size, 6)
+        count -= size
+
+
+# Read a CSV poses file in chunks, skipping the header line if any
+def _csvchunks(infile, chunk):
+    import itertools
+    import numpy
+
+    lines = (line for line in infile if line.strip())
+    first = next(lines, None)
+    if first is None: return  # Empty
+    try:
+        [float(val) for val in first.split(b',')]
+        lines = itertools.chain([first], lines)
+    except ValueError:
+        pass  # Header line, skipped
+
+    while True:
+        block = list(itertools.islice(lines, chunk))
+        if not block: return
+        yield numpy.loadtxt([line.decode('utf8') for line in block],
+                            delimiter = ',', ndmin = 2)
+
+
+''' Solve all the poses from the input file into the output file (both open
+binary files, or stdin/stdout), chunk by chunk, so that the memory use stays
+the same no matter the size of the input. Each output row holds the six
+actuator lengths followed by the feasibility (1 if within the limiter
+extents, 0 if not). The output format is either 'csv' (with a header line)
+or 'npy', an (N, 7) array; for the latter, the output must be seekable if
+the number of poses is not known in advance (i.e. the input is a CSV).
+Uses the module geometry if no geometry is given. Returns the number of
+the poses solved.
+'''
+def solvefile(infile, outfile, informat = 'csv', outformat = 'csv',
+              chunk = 65536, geometry = None):
+    import numpy
+
+    if geometry is None: geometry = getgeometry()
+
+    # Open the input, the count of the poses is known only for NPY
+    count, chunks = readposes(infile, informat, chunk)
+
+    # Start the output, with a fixed-size NPY header to be rewritten at the
+    # end if the count was not known
+    def npyheader(count):
+        text = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, 7), }"
+        text = (text % count).ljust(128 - 10 - 1) + '\n'
+        return b'\x93NUMPY\x01\x00' + bytes((len(text), 0)) + text.encode()
+
+    if outformat == 'csv':
+        outfile.write(b'l0,l1,l2,l3,l4,l5,feasible\n')
+    else:
+        if count is None:
+            if not outfile.seekable():
+                raise ValueError('NPY output of unknown length needs a file')
+            start = outfile.tell()
+        outfile.write(npyheader(count or 0))
+
+    total = 0
+    for poses in chunks:
+        lengths, feasible = geometry.solvebatch(*poses.T)
+        rows = numpy.column_stack((lengths, feasible))
+        if outformat == 'csv':
+            numpy.savetxt(outfile, rows, delimiter = ',',
+                          fmt = ['%.6f'] * 6 + ['%d'])
+        else:
+            outfile.write(rows.astype('<f8').tobytes())
+        total += len(poses)
+
+    # Final count into the NPY header
+    if outformat == 'npy' and count is None:
+        end = outfile.tell()
+        outfile.seek(start)
+        outfile.write(npyheader(total))
+        outfile.seek(end)
+
+    outfile.flush()
+    return total
+
+
 # Self-test
 # =========
 
 if __name__ == '__main__':
-    print('Stewart platform actuator calculator, oton.ribic@bug.hr')
-    print(stewart(azimuth = 0))
\ No newline at end of file
+    import argparse
+    import sys
+
+    if len(sys.argv) == 1:
+        print('Stewart platform actuator calculator, oton.ribic@bug.hr')
+        print(stewart(azimuth = 0))
+        sys.exit()
+
+    # Batch mode: solve a file of poses
+    parser = argparse.ArgumentParser(
+        description = 'Solve a CSV or NPY file of poses (xd, yd, zd, azimuth, '
+                      'alpha, beta per row) into actuator lengths and '
+                      'feasibility.')
+    parser.add_argument('input', help = 'Poses file, or - for stdin')
+    parser.add_argument('output', nargs = '?', default = '-',
+                        help = 'Output file, or - for stdout (default)')
+    parser.add_argument('--informat', choices = ('csv', 'npy'),
+                        help = 'Input format (default by the extension, or csv)')
+    parser.add_argument('--outformat', choices = ('csv', 'npy'),
+                        help = 'Output format (default by the extension, or csv)')
+    parser.add_argument('--chunk', type = int, default = 65536,
+                        help = 'Poses per chunk (default 65536)')
+    parser.add_argument('--geometry',
+                        help = 'JSON geometry file (default module constants)')
+    arguments = parser.parse_args()
+
+    def getformat(name, given):
+        if given: return given
+        return 'npy' if name.lower().endswith('.npy') else 'csv'
+
+    informat = getformat(arguments.input, arguments.informat)
+    outformat = getformat(arguments.output, arguments.outformat)
+    geometry = loadgeometry(arguments.geometry) if arguments.geometry else None
+
+    infile = sys.stdin.buffer if arguments.input == '-' else \
+             open(arguments.input, 'rb')
+    outfile = sys.stdout.buffer if arguments.output == '-' else \
+              open(arguments.output, 'wb')
+    with infile, outfile:
+        total = solvefile(infile, outfile, informat, outformat,
+                          arguments.chunk, geometry)
+    print('Solved', total, 'poses', file = sys.stderr)
\ No newline at end of file
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stewart platform kinematics benchmark
+-------------------------------------
+
+Part of Stormpack
+
+Reproducible micro-benchmarks of stewart.py, to size the control loop
+budgets and to catch performance regressions. For each of the calculation
+paths (the plain stewart function, with the limiter, the cached geometry,
+the memoized poses, the batch and the forward kinematics) and a few platform
+geometries, it measures:
+- poses per second,
+- latency percentiles per call (50th, 90th, 99th, and the maximum) in us,
+- memory allocated during a single call (peak, as traced by tracemalloc).
+
+The poses are pseudo-random (with a fixed seed) around the mid height of the
+platform, so the runs are comparable. The results are written to a JSON file.
+Usage:
+python stewartbench.py [--calls 20000] [--output stewartbench.json]
+
+Requires NumPy (pip install numpy) for the batch paths.
+"""
+
+import argparse
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+import stewart
+
+# Geometries to benchmark: name and dimensions for stewart.Geometry
+GEOMETRIES = {'default': {},
+              'small': {'rootdistfc': 60, 'rootadjdist': 12, 'tgtdistfc': 50,
+                        'tgtadjdist': 10, 'tgtvertoffset': 8,
+                        'actmin': 40, 'actmax': 70},
+              'large': {'rootdistfc': 480, 'rootadjdist': 96, 'tgtdistfc': 400,
+                        'tgtadjdist': 80, 'tgtvertoffset': 64,
+                        'actmin': 320, 'actmax': 560}}
+
+
+''' Pseudo-random poses for the geometry, around its mid height, as a list
+of the given count of six-item lists.
+'''
+def getposes(geometry, count, seed = 1):
+    generator = random.Random(seed)
+    scale = geometry.actmin / 80  # Relative to the default platform
+    height = (geometry.actmin + geometry.actmax) / 2 * 0.8
+    return [[generator.uniform(-10, 10) * scale,
+             generator.uniform(-10, 10) * scale,
+             height + generator.uniform(-10, 10) * scale,
+             generator.uniform(-15, 15),
+             generator.uniform(-10, 10),
+             generator.uniform(-10, 10)] for pose in range(count)]
+
+
+''' Benchmark a function called with each of the given arguments (a list of
+argument tuples), each call being one pass over the given number of poses.
+Returns the dictionary of results.
+'''
+def measure(function, arguments, poses = 1):
+
+    # Warm up (imports, caches)
+    for args in arguments[:10]: function(*args)
+
+    # Latencies of the individual calls
+    latencies = []
+    clock = time.perf_counter_ns
+    for args in arguments:
+        start = clock()
+        function(*args)
+        latencies.append(clock() - start)
+    latencies.sort()
+    total = sum(latencies)
+
+    # Memory allocated by a single call
+    tracemalloc.start()
+    peaks = []
+    for args in arguments[:100]:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function(*args)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    def percentile(share):
+        return latencies[min(len(latencies) - 1,
+                             int(share * len(latencies)))] / 1000
+
+    return {'calls': len(latencies),
+            'posespercall': poses,
+            'posespersec': len(latencies) * poses / total * 1e9,
+            'latency_us': {'p50': percentile(0.5), 'p90': percentile(0.9),
+                           'p99': percentile(0.99),
+                           'max': latencies[-1] / 1000},
+            'peakbytes': max(peaks)}
+
+
+''' Run all the benchmarks with the given number of calls for the scalar
+paths (batch paths are run with fewer, larger calls). Returns the list of
+results, also printing them out as they go.
+'''
+def benchmark(calls = 20000, batchsize = 10000):
+    import numpy
+
+    results = []
+    def record(name, geometryname, result):
+        result['name'] = name
+        result['geometry'] = geometryname
+        results.append(result)
+        print('%-16s %-8s %12.0f poses/s  p50 %9.2f us  p99 %9.2f us  %8d B' %
+              (name, geometryname, result['posespersec'],
+               result['latency_us']['p50'], result['latency_us']['p99'],
+               result['peakbytes']))
+
+    for geometryname, dimensions in GEOMETRIES.items():
+        geometry = stewart.Geometry(**dimensions)
+        poses = getposes(geometry, calls)
+
+        record('solve', geometryname,
+               measure(geometry.solve, poses))
+        record('solve-limiter', geometryname,
+               measure(lambda *pose: geometry.solve(*pose, limiter = True),
+                       poses))
+
+        # Memoized, cycling among a few recurring poses (hits after the
+        # first round)
+        cache = stewart.PoseCache(geometry)
+        record('posecache-hit', geometryname,
+               measure(cache.solve, poses[:10] * (calls // 10)))
+
+        # Batch paths, with poses as arrays
+        batches = max(10, calls // batchsize)
+        array = numpy.array(getposes(geometry, batchsize))
+        record('solvebatch', geometryname,
+               measure(geometry.solvebatch, [array.T] * batches, batchsize))
+        record('margins', geometryname,
+               measure(geometry.margins, [array.T] * batches, batchsize))
+
+        # Forward kinematics, warm started near the solution
+        lengths = geometry.solvebatch(*array.T)[0]
+        guesses = array + 0.1
+        record('forward-warm', geometryname,
+               measure(geometry.forward,
+                       [(lengths[pose], guesses[pose])
+                        for pose in range(min(calls, batchsize) // 10)]))
+        record('forwardbatch', geometryname,
+               measure(geometry.forwardbatch, [(lengths, guesses)] * batches,
+                       batchsize))
+
+    # The module function, on top of the module geometry
+    record('stewart', 'module',
+           measure(stewart.stewart, getposes(stewart.getgeometry(), calls)))
+    record('stewart-limiter', 'module',
+           measure(lambda *pose: stewart.stewart(*pose, limiter = True),
+                   getposes(stewart.getgeometry(), calls)))
+
+    return results
+
+
+# Run if main
+# ===========
+
+if __name__ == '__main__':
+    import numpy
+    parser = argparse.ArgumentParser(description = 'Stewart kinematics benchmark')
+    parser.add_argument('--calls', type = int, default = 20000,
+                        help = 'Number of calls per scalar benchmark')
+    parser.add_argument('--batchsize', type = int, default = 10000,
+                        help = 'Number of poses per batch call')
+    parser.add_argument('--output', default = 'stewartbench.json',
+                        help = 'JSON file to write the results to')
+    arguments = parser.parse_args()
+
+    print('Stewart platform kinematics benchmark, oton.ribic@bug.hr')
+    results = benchmark(arguments.calls, arguments.batchsize)
+    report = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(),
+              'implementation': platform.python_implementation(),
+              'numpy': numpy.__version__,
+              'machine': platform.machine(),
+              'platform': platform.platform(),
+              'results': results}
+    with open(arguments.output, 'w', encoding = 'utf8') as output:
+        json.dump(report, output, indent = 2)
+    print('Results written to', arguments.output)
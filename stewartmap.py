@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stewart platform workspace map
+------------------------------
+
+Part of Stormpack
+
+Samples the whole 6-DOF pose space of a Stewart platform (see stewart.py) on
+a regular grid and records the actuator lengths and the limiter feasibility
+of every grid point. The grid is split into chunks which are evaluated over a
+pool of processes, each writing straight into memory-mapped .npy files, so
+even grids far larger than the memory can be built, and an interrupted build
+simply resumes where it stopped when run again.
+
+A map consists of three files sharing the same base path:
+<path>.json - grid and geometry description
+<path>.lengths.npy - (N, 6) float32 array of actuator lengths
+<path>.feasible.npy - N-sized int8 array: 1 feasible, 0 not, -1 not yet done
+
+The grid is given as six axes in the pose order (xd, yd, zd, azimuth, alpha,
+beta), each being either a single fixed value, or a (lowest, highest, count)
+triplet of evenly spaced values. Grid points are ordered with the last axis
+(beta) changing the fastest.
+
+Requires NumPy (pip install numpy).
+"""
+
+import concurrent.futures
+import json
+import os
+
+import numpy
+
+import stewart
+
+# Names of the axes, in the pose order
+AXES = ('xd', 'yd', 'zd', 'azimuth', 'alpha', 'beta')
+
+
+# Grid helpers
+# ============
+
+''' Normalize the grid description: returns a list of six [lowest, highest,
+count] triplets, with the fixed values expanded to single-point axes.
+'''
+def normalizegrid(grid):
+    if len(grid) != 6:
+        raise ValueError('Grid needs six axes: ' + ', '.join(AXES))
+
+    axes = []
+    for axis in grid:
+        if isinstance(axis, (int, float)):
+            axes.append([float(axis), float(axis), 1])  # Fixed value
+        else:
+            lowest, highest, count = axis
+            axes.append([float(lowest), float(highest), int(count)])
+    return axes
+
+
+''' Values of each of the six grid axes, as a list of arrays.
+'''
+def gridvalues(axes):
+    return [numpy.linspace(lowest, highest, count)
+            for lowest, highest, count in axes]
+
+
+''' Index of the nearest grid value along each axis, for an array of values
+of every axis (a list of six arrays, broadcast against each other). Returns
+a list of six index arrays, clipped to the grid.
+'''
+def nearestindex(axes, values):
+    indices = []
+    for (lowest, highest, count), value in zip(axes, values):
+        value = numpy.asarray(value, dtype = float)
+        if count == 1:
+            indices.append(numpy.zeros(value.shape, dtype = numpy.intp))
+            continue
+        index = numpy.rint((value - lowest) / (highest - lowest) * (count - 1))
+        indices.append(numpy.clip(index, 0, count - 1).astype(numpy.intp))
+    return numpy.broadcast_arrays(*indices)
+
+
+''' Poses (M, 6) for the flat grid point indices from start to stop.
+'''
+def gridposes(axes, start, stop):
+    values = gridvalues(axes)
+    shape = [count for lowest, highest, count in axes]
+    indices = numpy.unravel_index(numpy.arange(start, stop), shape)
+    return numpy.stack([values[axis][index]
+                        for axis, index in enumerate(indices)], axis = -1)
+
+
+# Building
+# ========
+
+# Evaluate a single chunk of the grid (in a worker process) and write it to
+# the map files
+def _evaluate(path, axes, geometry, start, stop):
+    poses = gridposes(axes, start, stop)
+    lengths, feasible = geometry.solvebatch(*poses.T)
+
+    maplengths = numpy.load(path + '.lengths.npy', mmap_mode = 'r+')
+    mapfeasible = numpy.load(path + '.feasible.npy', mmap_mode = 'r+')
+    maplengths[start:stop] = lengths
+    maplengths.flush()
+    # Feasibility last, as it marks the chunk as done
+    mapfeasible[start:stop] = feasible
+    mapfeasible.flush()
+    return stop - start
+
+
+''' Build (or resume building) a workspace map at the given base path, for the
+given grid and geometry (the module geometry of stewart.py if not given). The
+grid is split into chunks of the given number of poses, evaluated over a pool
+of the given number of processes (all cores if not given). Returns the
+finished WorkspaceMap. On platforms spawning the processes, e.g. Windows,
+call it only from within the "if __name__ == '__main__'" block.
+'''
+def buildmap(path, grid, geometry = None, processes = None, chunk = 250000):
+    if geometry is None: geometry = stewart.getgeometry()
+    axes = normalizegrid(grid)
+    meta = {'axes': axes,
+            'roots': [list(point) for point in geometry.roots],
+            'targets': [list(point) for point in geometry.tgts],
+            'actmin': geometry.actmin,
+            'actmax': geometry.actmax}
+    total = int(numpy.prod([count for lowest, highest, count in axes]))
+
+    if os.path.exists(path + '.json'):
+        # Resume, but only the very same map
+        with open(path + '.json', encoding = 'utf8') as metafile:
+            if json.load(metafile) != meta:
+                raise ValueError('Existing map at ' + path +
+                                 ' has a different grid or geometry')
+        feasible = numpy.load(path + '.feasible.npy', mmap_mode = 'r')
+    else:
+        # Create new files
+        numpy.lib.format.open_memmap(path + '.lengths.npy', mode = 'w+',
+                                     dtype = numpy.float32, shape = (total, 6))
+        feasible = numpy.lib.format.open_memmap(path + '.feasible.npy',
+                                                mode = 'w+', dtype = numpy.int8,
+                                                shape = (total,))
+        feasible[:] = -1
+        feasible.flush()
+        with open(path + '.json', 'w', encoding = 'utf8') as metafile:
+            json.dump(meta, metafile)
+
+    # Chunks still to be done
+    pending = [(start, min(start + chunk, total))
+               for start in range(0, total, chunk)
+               if (feasible[start:start + chunk] < 0).any()]
+    del feasible
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        jobs = [pool.submit(_evaluate, path, axes, geometry, start, stop)
+                for start, stop in pending]
+        for job in concurrent.futures.as_completed(jobs):
+            job.result()  # Raise any errors from the workers
+
+    return WorkspaceMap(path)
+
+
+# Querying
+# ========
+
+''' A finished (or partially built) workspace map, opened read-only from its
+base path, with the arrays memory-mapped, so opening it is instantaneous.
+'''
+class WorkspaceMap:
+
+    def __init__(self, path):
+        with open(path + '.json', encoding = 'utf8') as metafile:
+            meta = json.load(metafile)
+        self.path = path
+        self.axes = meta['axes']
+        self.actmin = meta['actmin']
+        self.actmax = meta['actmax']
+        self.shape = tuple(count for lowest, highest, count in self.axes)
+        self.values = gridvalues(self.axes)
+        self.lengths = numpy.load(path + '.lengths.npy', mmap_mode = 'r')
+        self.feasible = numpy.load(path + '.feasible.npy', mmap_mode = 'r')
+
+
+    ''' Share of the grid that has already been evaluated (0 to 1).
+    '''
+    def complete(self):
+        return float((self.feasible >= 0).mean())
+
+
+    ''' Whether the poses are reachable, judged by the nearest grid point.
+    Takes arrays (or scalars) as stewart.stewartbatch, and returns a boolean
+    array. Points not evaluated yet count as unreachable.
+    '''
+    def reachable(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+                  beta = 0):
+        index = numpy.ravel_multi_index(
+            nearestindex(self.axes, (xd, yd, zd, azimuth, alpha, beta)),
+            self.shape)
+        return self.feasible[index] > 0
+
+
+    ''' Lengths at the nearest grid points, as an (N, 6) array.
+    '''
+    def nearestlengths(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+                       beta = 0):
+        index = numpy.ravel_multi_index(
+            nearestindex(self.axes, (xd, yd, zd, azimuth, alpha, beta)),
+            self.shape)
+        return numpy.asarray(self.lengths[numpy.atleast_1d(index)],
+                             dtype = float)
+
+
+    ''' Maximum reachable height (Z) at the given tilts and the other values,
+    i.e. the highest feasible grid point along the Z axis at the nearest grid
+    point of the others. Takes arrays (or scalars), and returns an array of
+    heights, NaN where no height is feasible.
+    '''
+    def maxz(self, azimuth = 0, alpha = 0, beta = 0, xd = 0, yd = 0):
+        ix, iy, iz, iaz, ia, ib = nearestindex(
+            self.axes, (xd, yd, 0, azimuth, alpha, beta))
+        grid = self.feasible.reshape(self.shape)
+        # Feasibility along Z, (M, count of Z)
+        column = grid[ix.ravel(), iy.ravel(), :, iaz.ravel(), ia.ravel(),
+                      ib.ravel()] > 0
+        # Highest feasible index, found from the top down
+        top = self.shape[2] - 1 - numpy.argmax(column[:, ::-1], axis = 1)
+        heights = numpy.where(column.any(axis = 1), self.values[2][top],
+                              numpy.nan)
+        return heights.reshape(ix.shape)
+
+
+# Self-test
+# =========
+
+if __name__ == '__main__':
+    import tempfile
+    print('Stewart platform workspace map, oton.ribic@bug.hr')
+    path = os.path.join(tempfile.mkdtemp(), 'workspace')
+    workspace = buildmap(path, [(-30, 30, 7), (-30, 30, 7), (60, 160, 21),
+                                (-30, 30, 7), (-20, 20, 5), (-20, 20, 5)])
+    print('Map at', path, 'complete:', workspace.complete())
+    print('Reachable home:', workspace.reachable(zd = 100))
+    print('Max Z level:', workspace.maxz())
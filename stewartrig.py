@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stewart platform on EV3 motors
+------------------------------
+
+Part of Stormpack
+
+Drives a Stewart platform (see stewart.py) whose six linear actuators are
+each run by an EV3 motor, spread over multiple EV3 bricks (e.g. four motors
+on one and two on the other). Each pose is solved into the six actuator
+lengths, the lengths are converted into motor positions in degrees, and all
+the bricks are commanded concurrently with the simultaneous relative rotation
+(rotateto with simult), so that all six legs move in one synchronized step.
+The motor speeds across the bricks are scaled so that all the motors finish
+at the same moment, as within one brick.
+
+For each actuator, the rig needs:
+- the brick (index in the list of EV3 objects) and port (1-4) of its motor,
+- the ratio of the motor degrees per millimeter of the actuator length,
+  i.e. the gear and lead-screw ratio, negative if the motor runs reversed,
+- the zero offset, i.e. the actuator length in millimeters when its motor
+  is in its zero position (as when the connection was opened).
+
+Example, with actuators 0-3 on the first brick and 4-5 on the second:
+rig = Rig([mindctrl.EV3('COM8'), mindctrl.EV3('COM9')],
+          [(0, 1), (0, 2), (0, 3), (0, 4), (1, 1), (1, 2)],
+          ratios = 360 / 2, zeros = 100)
+rig.moveto(zd = 110, alpha = 5)
+"""
+
+import concurrent.futures
+
+import mindctrl
+import stewart
+
+
+''' Six actuators of a Stewart platform, mapped onto the motors of multiple
+EV3 bricks. The ratios and zeros can be either a single value for all the
+actuators, or a list of six. Uses the module geometry of stewart.py if no
+geometry is given.
+'''
+class Rig:
+
+    def __init__(self, bricks, motors, ratios = 1, zeros = 0, geometry = None):
+        if len(motors) != 6:
+            raise ValueError('Rig needs exactly six (brick, port) motors')
+        if isinstance(ratios, (int, float)): ratios = [ratios] * 6
+        if isinstance(zeros, (int, float)): zeros = [zeros] * 6
+
+        self.bricks = list(bricks)
+        self.motors = [(brick, port) for brick, port in motors]
+        self.ratios = list(ratios)
+        self.zeros = list(zeros)
+        self.geometry = geometry or stewart.getgeometry()
+
+
+    ''' Motor positions in degrees for six actuator lengths: returns a list
+    with four positions (or None where not used) per brick. The positions are
+    rounded to whole degrees, as the motors are commanded, so that no fraction
+    is lost between the moves.
+    '''
+    def degrees(self, lengths):
+        positions = [[None] * 4 for brick in self.bricks]
+        for act, (brick, port) in enumerate(self.motors):
+            positions[brick][port - 1] = \
+                round((lengths[act] - self.zeros[act]) * self.ratios[act])
+        return positions
+
+
+    ''' Move the platform to the given pose, with the given speed applying to
+    the motor that rotates the most. Returns the actuator lengths, or None
+    (without moving) if the pose is beyond the actuator extents.
+    '''
+    def moveto(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0,
+               beta = 0, speed = 100):
+        lengths = self.geometry.solve(xd, yd, zd, azimuth, alpha, beta,
+                                      limiter = True)
+        if lengths is None:
+            mindctrl.addlog('Stewart ERROR: Pose out of actuator extents')
+            return None  # Error a priori
+
+        self.movelengths(lengths, speed)
+        return lengths
+
+
+    ''' Move the actuators to six given lengths, with all the bricks running
+    concurrently, and return when all of them have finished. If any of the
+    bricks failed, its error is raised after all the others have finished.
+    '''
+    def movelengths(self, lengths, speed = 100):
+        positions = self.degrees(lengths)
+
+        # Largest rotation of each brick, so that the speeds can be scaled
+        # for all the bricks to finish together
+        largest = []
+        for ev3, brickpositions in zip(self.bricks, positions):
+            largest.append(max([abs((pos - ev3.relposition[port]) *
+                                    ev3.relscale[port])
+                                for port, pos in enumerate(brickpositions)
+                                if pos is not None] or [0]))
+        overall = max(largest)
+        if not overall: return  # Nothing to move
+
+        # Start all the bricks, each in its own thread
+        moving = [(ev3, brickpositions, brickmax) for ev3, brickpositions,
+                  brickmax in zip(self.bricks, positions, largest) if brickmax]
+        with concurrent.futures.ThreadPoolExecutor(len(moving)) as pool:
+            jobs = [pool.submit(ev3.rotateto, *brickpositions, simult = True,
+                                speed = max(1, round(speed * brickmax /
+                                                     overall)))
+                    for ev3, brickpositions, brickmax in moving]
+            concurrent.futures.wait(jobs)
+
+        # Raise the error of any brick, once all of them have finished
+        for job in jobs: job.result()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stewart platform kinematics server
+----------------------------------
+
+Part of Stormpack
+
+Serves the Stewart platform calculations (see stewart.py) to any number of
+local processes over a TCP or a Unix socket, from a single process holding
+the geometry. Requests arriving from all the clients within a short window
+are gathered and solved together in one batch, so the throughput grows with
+the number of clients instead of each one paying the per-call costs.
+
+The protocol is binary, and requests can be pipelined (several sent before
+reading the replies), with the replies coming back in the order of the
+requests on each connection:
+- request: the pose, six little-endian doubles (xd, yd, zd, azimuth, alpha,
+  beta), 48 bytes,
+- reply: the six actuator lengths as little-endian doubles, followed by one
+  byte of feasibility (1 within the limiter extents, 0 not), 49 bytes.
+
+Start it from the command line with the address, either a path of a Unix
+socket or host:port for TCP:
+python stewartserver.py /tmp/stewart.sock
+python stewartserver.py localhost:5800 --geometry rig2.json
+
+And use it from the clients:
+client = Client('/tmp/stewart.sock')
+lengths, feasible = client.solve(0, 0, 100, 10, 0, 0)
+
+Requires NumPy (pip install numpy) on the server side.
+"""
+
+import selectors
+import socket
+import struct
+import time
+
+import stewart
+
+# Request and reply formats
+REQUEST = struct.Struct('<6d')
+REPLY = struct.Struct('<6dB')
+
+
+# Open a listening or a connecting socket for the address: a string being a
+# Unix socket path, a (host, port) tuple being TCP
+def _socket(address):
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+''' Server solving the poses from all its clients in batches. The requests
+are gathered for up to the window [s] after the first one pending, or until
+maxbatch of them are pending, and then solved together. Uses the module
+geometry of stewart.py if no geometry is given.
+'''
+class Server:
+
+    def __init__(self, address, geometry = None, window = 0.001,
+                 maxbatch = 4096):
+        self.address = address
+        self.geometry = geometry or stewart.getgeometry()
+        self.window = window
+        self.maxbatch = maxbatch
+        self.running = False
+        self.batches = 0  # Statistics: batches and requests solved
+        self.requests = 0
+
+        self.listener = _socket(address)
+        if not isinstance(address, str):
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+        self._inputs = {}  # Incomplete input per client
+        self._outputs = {}  # Unsent output per client
+        self._pending = []  # (client, pose) waiting for the batch
+        self._first = None  # Time the oldest pending request arrived
+
+
+    ''' Serve until stopped (by stop, e.g. from another thread).
+    '''
+    def serve(self):
+        self.running = True
+        while self.running:
+            # Wait no longer than until the pending batch is due
+            timeout = 0.1
+            if self._pending:
+                timeout = max(0, self._first + self.window - time.perf_counter())
+
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.listener:
+                    self._accept()
+                    continue
+                if events & selectors.EVENT_READ: self._read(key.fileobj)
+                if key.fileobj not in self._inputs: continue  # Dropped
+                if events & selectors.EVENT_WRITE: self._write(key.fileobj)
+
+            if self._pending and \
+               (len(self._pending) >= self.maxbatch or
+                time.perf_counter() >= self._first + self.window):
+                self._solve()
+
+
+    ''' Stop serving, after the current round.
+    '''
+    def stop(self):
+        self.running = False
+
+
+    ''' Close all the connections and the listening socket.
+    '''
+    def close(self):
+        for client in list(self._inputs): self._drop(client)
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        self.selector.close()
+
+
+    # Accept a new client
+    def _accept(self):
+        client = self.listener.accept()[0]
+        client.setblocking(False)
+        self._inputs[client] = b''
+        self._outputs[client] = b''
+        self.selector.register(client, selectors.EVENT_READ)
+
+
+    # Drop a client
+    def _drop(self, client):
+        self.selector.unregister(client)
+        del self._inputs[client]
+        del self._outputs[client]
+        client.close()
+        self._pending = [(other, pose) for other, pose in self._pending
+                         if other is not client]
+
+
+    # Read requests from a client, into the pending ones
+    def _read(self, client):
+        try:
+            data = client.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(client)  # Disconnected
+            return
+
+        data = self._inputs[client] + data
+        complete = len(data) - len(data) % REQUEST.size
+        if complete and not self._pending: self._first = time.perf_counter()
+        for pose in REQUEST.iter_unpack(data[:complete]):
+            self._pending.append((client, pose))
+        self._inputs[client] = data[complete:]
+
+
+    # Send the unsent replies to a client
+    def _write(self, client):
+        try:
+            sent = client.send(self._outputs[client])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._drop(client)
+            return
+        self._outputs[client] = self._outputs[client][sent:]
+        if not self._outputs[client]:
+            self.selector.modify(client, selectors.EVENT_READ)
+
+
+    # Solve all the pending requests in one batch, and queue the replies
+    def _solve(self):
+        pending = self._pending[:self.maxbatch]
+        self._pending = self._pending[self.maxbatch:]
+        self._first = time.perf_counter() if self._pending else None
+
+        lengths, feasible = self.geometry.solvebatch(
+            *zip(*[pose for client, pose in pending]))
+        self.batches += 1
+        self.requests += len(pending)
+
+        replies = {}
+        for (client, pose), row, ok in zip(pending, lengths.tolist(),
+                                           feasible.tolist()):
+            replies.setdefault(client, []).append(REPLY.pack(*row, ok))
+        for client, chunks in replies.items():
+            waiting = bool(self._outputs[client])
+            self._outputs[client] += b''.join(chunks)
+            if not waiting:
+                self.selector.modify(client,
+                                     selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+
+''' Client of the kinematics server at the given address.
+'''
+class Client:
+
+    def __init__(self, address):
+        self.sock = _socket(address)
+        self.sock.connect(address)
+
+
+    ''' Close the connection.
+    '''
+    def close(self):
+        self.sock.close()
+
+
+    # Receive exactly the given number of bytes
+    def _receive(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk: raise ConnectionError('Kinematics server disconnected')
+            data += chunk
+        return data
+
+
+    ''' Solve a single pose: returns a list of six lengths, and whether they
+    are within the limiter extents.
+    '''
+    def solve(self, xd = 0, yd = 0, zd = 0, azimuth = 0, alpha = 0, beta = 0):
+        self.sock.sendall(REQUEST.pack(xd, yd, zd, azimuth, alpha, beta))
+        reply = REPLY.unpack(self._receive(REPLY.size))
+        return list(reply[:6]), bool(reply[6])
+
+
+    ''' Solve many poses (a list of six-item poses), pipelined: returns a list
+    of lists of six lengths, and a list of their feasibilities.
+    '''
+    def solvemany(self, poses):
+        self.sock.sendall(b''.join([REQUEST.pack(*pose) for pose in poses]))
+        data = self._receive(REPLY.size * len(poses))
+        replies = list(REPLY.iter_unpack(data))
+        return [list(reply[:6]) for reply in replies], \
+               [bool(reply[6]) for reply in replies]
+
+
+# Run if main
+# ===========
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description = 'Stewart kinematics server')
+    parser.add_argument('address', help = 'Unix socket path, or host:port')
+    parser.add_argument('--geometry',
+                        help = 'JSON geometry file (default module constants)')
+    parser.add_argument('--window', type = float, default = 0.001,
+                        help = 'Batching window in seconds (default 0.001)')
+    arguments = parser.parse_args()
+
+    address = arguments.address
+    if ':' in address and not os.path.sep in address:
+        host, port = address.rsplit(':', 1)
+        address = (host, int(port))
+    elif os.path.exists(address):
+        os.unlink(address)  # Stale socket from a previous run
+    geometry = stewart.loadgeometry(arguments.geometry) \
+               if arguments.geometry else None
+
+    print('Stewart platform kinematics server, oton.ribic@bug.hr')
+    print('Listening at', arguments.address)
+    server = Server(address, geometry, arguments.window)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    print('Served', server.requests, 'requests in', server.batches, 'batches')
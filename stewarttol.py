@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stewart platform tolerance analysis
+-----------------------------------
+
+Part of Stormpack
+
+Monte Carlo analysis of how the tolerances of a built Stewart platform (see
+stewart.py) turn into the errors of its pose. In each sample, the actuator
+roots and targets are misplaced at random (the "real" platform), and the
+actuator lengths commanded by the nominal geometry get random errors as
+well. The pose the real platform actually takes on those lengths is found
+by the forward kinematics, and compared against the commanded pose. All the
+poses of a sample are solved in one batch, and the samples are spread over a
+pool of processes.
+
+The errors are reported per pose region: the poses are grouped by region
+labels given along with them (e.g. by height bands, or as the grid cells of
+a workspace), or all the poses form a single region if not given. Each
+region keeps a histogram of its errors (about 86 kB), so the regions should
+be a moderate number of groups rather than the individual poses of a large
+set.
+
+Requires NumPy (pip install numpy).
+"""
+
+import concurrent.futures
+import os
+
+import numpy
+
+import stewart
+
+# Names of the pose values, in the pose order
+AXES = ('xd', 'yd', 'zd', 'azimuth', 'alpha', 'beta')
+
+
+# Edges of the histogram bins of the absolute pose errors, for the p95 (log
+# spaced, about 1 % apart, from 1e-6 to 1e3 mm or degrees)
+EDGES = numpy.geomspace(1e-6, 1e3, 1801)
+
+# Pose-sample errors gathered before they are reduced into the statistics
+CHUNK = 2 ** 20
+
+
+# Empty statistics for the given number of regions: the converged counts,
+# sums, sums of squares, maxima and histograms of the pose errors
+def _emptystats(regions):
+    return {'count': numpy.zeros(regions, dtype = numpy.int64),
+            'sum': numpy.zeros((regions, 6)),
+            'sumsq': numpy.zeros((regions, 6)),
+            'max': numpy.zeros((regions, 6)),
+            'histogram': numpy.zeros((regions, 6, len(EDGES) + 1),
+                                     dtype = numpy.int64)}
+
+
+# Reduce the pose errors (samples, poses, 6) of the poses in the regions of
+# the given indices into the statistics, skipping the unconverged (NaN)
+def _reduce(stats, errors, inverse):
+    regions = len(stats['count'])
+    inverse = numpy.broadcast_to(inverse, errors.shape[:2]).reshape(-1)
+    errors = errors.reshape(-1, 6)
+    converged = ~numpy.isnan(errors).any(axis = 1)
+    inverse = inverse[converged]
+    errors = errors[converged]
+    absolute = numpy.abs(errors)
+
+    stats['count'] += numpy.bincount(inverse, minlength = regions)
+    for axis in range(6):
+        stats['sum'][:, axis] += numpy.bincount(
+            inverse, errors[:, axis], minlength = regions)
+        stats['sumsq'][:, axis] += numpy.bincount(
+            inverse, errors[:, axis] ** 2, minlength = regions)
+        numpy.maximum.at(stats['max'][:, axis], inverse, absolute[:, axis])
+        bins = numpy.searchsorted(EDGES, absolute[:, axis])
+        stats['histogram'][:, axis] += numpy.bincount(
+            inverse * (len(EDGES) + 1) + bins,
+            minlength = regions * (len(EDGES) + 1)).reshape(regions, -1)
+
+
+# Run a number of samples (in a worker process), returning their statistics
+# per region (see _emptystats), with the poses in the regions of the given
+# indices
+def _samples(geometry, poses, lengths, anchorsigma, lengthsigma, count, seed,
+             inverse, regions):
+    generator = numpy.random.default_rng(seed)
+    roots = numpy.array(geometry.roots)
+    tgts = numpy.array(geometry.tgts)
+
+    stats = _emptystats(regions)
+    chunk = max(1, CHUNK // len(poses))  # Samples reduced at once
+    errors = numpy.empty((min(chunk, count),) + poses.shape)
+    filled = 0
+    for sample in range(count):
+        # Misplaced anchors make the real platform
+        real = stewart.Geometry(
+            actmin = geometry.actmin, actmax = geometry.actmax,
+            roots = roots + generator.normal(0, anchorsigma, roots.shape),
+            tgts = tgts + generator.normal(0, anchorsigma, tgts.shape))
+
+        # Lengths with errors, and where the real platform goes on them
+        actual = lengths + generator.normal(0, lengthsigma, lengths.shape)
+        reached, converged = real.forwardbatch(actual, poses)
+        reached[~converged] = numpy.nan
+        errors[filled] = reached - poses
+        filled += 1
+
+        if filled == len(errors):
+            _reduce(stats, errors, inverse)
+            filled = 0
+    if filled: _reduce(stats, errors[:filled], inverse)
+
+    return stats
+
+
+''' Run the Monte Carlo tolerance analysis for an (N, 6) array of nominal
+poses, with the given standard deviations of the anchor (root and target)
+misplacement in all three axes [mm] and of the actuator length errors [mm].
+The samples are split into batches over a pool of the given number of
+processes (all cores if not given), each reducing its pose errors into the
+statistics per region, so the memory does not grow with the samples.
+Optional N-sized region labels group the poses into regions (all of them in
+a single region labelled 0 if not given). Uses the module geometry of
+stewart.py if no geometry is given. Returns a dictionary of the region
+labels, each with a dictionary of:
+- poses: number of the poses in the region,
+- samples: number of the samples run (for each of the poses),
+- converged: number of the pose samples (of poses * samples) converged, all
+  the following being of those,
+- mean, std, p95, max: six-item lists of the statistics of the pose errors
+  (xd, yd, zd in mm, azimuth, alpha, beta in degrees), where p95 and max are
+  of their absolute values, p95 approximate (to about 1 %, by a histogram).
+On platforms spawning the processes, e.g. Windows, call it only from within
+the "if __name__ == '__main__'" block.
+'''
+def analyse(poses, anchorsigma = 0.5, lengthsigma = 0.2, samples = 1000,
+            regions = None, geometry = None, processes = None, seed = 0,
+            batch = None):
+    if geometry is None: geometry = stewart.getgeometry()
+    poses = numpy.atleast_2d(numpy.asarray(poses, dtype = float))
+    if regions is None: regions = numpy.zeros(len(poses), dtype = int)
+    labels, inverse = numpy.unique(numpy.asarray(regions),
+                                   return_inverse = True)
+    inverse = inverse.reshape(-1)
+    lengths = geometry.solvebatch(*poses.T)[0]
+
+    # Split the samples evenly among the processes
+    if processes is None: processes = os.cpu_count() or 1
+    if batch is None: batch = max(1, -(-samples // (processes * 4)))
+    counts = [min(batch, samples - start) for start in range(0, samples, batch)]
+    seeds = numpy.random.SeedSequence(seed).spawn(len(counts))
+
+    # Merge the statistics of all the batches
+    stats = _emptystats(len(labels))
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        jobs = [pool.submit(_samples, geometry, poses, lengths, anchorsigma,
+                            lengthsigma, count, childseed, inverse,
+                            len(labels))
+                for count, childseed in zip(counts, seeds)]
+        for job in concurrent.futures.as_completed(jobs):
+            result = job.result()
+            for name in ('count', 'sum', 'sumsq', 'histogram'):
+                stats[name] += result[name]
+            stats['max'] = numpy.maximum(stats['max'], result['max'])
+
+    # Statistics per region
+    report = {}
+    for index, region in enumerate(labels):
+        count = int(stats['count'][index])
+        key = region.item()
+        report[key] = {'poses': int((inverse == index).sum()),
+                       'samples': samples, 'converged': count}
+        if not count: continue  # Nothing converged
+        mean = stats['sum'][index] / count
+        variance = numpy.maximum(stats['sumsq'][index] / count - mean ** 2, 0)
+        report[key]['mean'] = mean.tolist()
+        report[key]['std'] = numpy.sqrt(variance).tolist()
+        report[key]['max'] = stats['max'][index].tolist()
+
+        # Percentile as the upper edge of its histogram bin, up to the maximum
+        cumulative = numpy.cumsum(stats['histogram'][index], axis = 1)
+        bins = (cumulative < 0.95 * count).sum(axis = 1)
+        upper = numpy.append(EDGES, numpy.inf)[bins]
+        report[key]['p95'] = numpy.minimum(upper, stats['max'][index]).tolist()
+
+    return report
+
+
+# Self-test
+# =========
+
+if __name__ == '__main__':
+    print('Stewart platform tolerance analysis, oton.ribic@bug.hr')
+    # Three height bands across the working range, with some tilts
+    generator = numpy.random.default_rng(1)
+    heights = numpy.repeat([95, 105, 115], 50)
+    poses = numpy.column_stack((generator.uniform(-10, 10, (150, 2)), heights,
+                                generator.uniform(-10, 10, (150, 3))))
+    report = analyse(poses, samples = 200, regions = heights)
+    for region, stats in report.items():
+        print('Z=%s mm, %d of %d pose samples converged' %
+              (region, stats['converged'], stats['poses'] * stats['samples']))
+        for axis, std, p95 in zip(AXES, stats['std'], stats['p95']):
+            print('  %-8s std %.3f  p95 %.3f' % (axis, std, p95))